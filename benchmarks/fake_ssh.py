@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+###########################################################################################
+# Job name:    Fake ssh for the rolling restart benchmark
+# Description: Stands in for ssh, sudo and systemctl when index_api.py runs against a
+#              simulated fleet, along with ss. Which one it acts as depends on the name it
+#              is called by. Each host's monitor.json files, systemd unit state and unit
+#              ports live under $FAKE_FLEET_DIR/<host>, and every ssh call is logged to
+#              $FAKE_SSH_LOG.
+# Output:      The remote command's output and exit code, like ssh.
+###########################################################################################
+
+
+import fnmatch
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+
+# Simulation settings, set by run_benchmark.py.
+fleet_dir = os.environ.get("FAKE_FLEET_DIR", "")
+ssh_log = os.environ.get("FAKE_SSH_LOG", "")
+ssh_latency = float(os.environ.get("FAKE_SSH_LATENCY", "0.02"))
+ssh_handshake = float(os.environ.get("FAKE_SSH_HANDSHAKE", "0.3"))
+ssh_failure_rate = float(os.environ.get("FAKE_SSH_FAILURE_RATE", "0"))
+restart_time = float(os.environ.get("FAKE_RESTART_TIME", "0.5"))
+restart_failure_rate = float(os.environ.get("FAKE_RESTART_FAILURE_RATE", "0"))
+
+
+# Function to append a line to a log file. Single short appends are atomic, so concurrent calls do not interleave.
+def log_line(path, line):
+
+    if path:
+        with open(path, "a") as log_file:
+            log_file.write(line + "\n")
+
+
+# Function to act as ssh. Options are skipped, the first argument after them is the host, and the rest is the remote command, which is run with bash in the hosts simulated root.
+def fake_ssh(args):
+
+    host = None
+    control_path = ""
+    control_command = ""
+    index = 0
+
+    # Skip the options. -o and -O take a value.
+    while index < len(args):
+        arg = args[index]
+        if arg in ["-o", "-O", "-p", "-l", "-i"]:
+            value = args[index + 1]
+            if arg == "-o" and value.startswith("ControlPath="):
+                control_path = value.split("=", 1)[1]
+            if arg == "-O":
+                control_command = value
+            index += 2
+        elif arg.startswith("-"):
+            index += 1
+        else:
+            host = arg
+            index += 1
+            break
+
+    remote_command = " ".join(args[index:])
+    host_root = os.path.join(fleet_dir, host)
+
+    # A master connection is simulated with a flag file. Without one, the call pays for a full handshake.
+    master_flag = os.path.join(host_root, ".ssh-master-" + hashlib.md5(control_path.encode()).hexdigest()[:12]) if control_path else ""
+
+    if control_command:
+        log_line(ssh_log, "control " + host + " " + control_command)
+        if control_command == "exit" and master_flag and os.path.exists(master_flag):
+            os.remove(master_flag)
+        return 0
+
+    log_line(ssh_log, "ssh " + host + " " + remote_command)
+
+    if master_flag and os.path.exists(master_flag):
+        time.sleep(ssh_latency)
+    else:
+        time.sleep(ssh_handshake + ssh_latency)
+        if master_flag:
+            open(master_flag, "w").close()
+
+    if random.random() < ssh_failure_rate:
+        sys.stderr.write("ssh: connect to host " + host + " port 22: Connection timed out\n")
+        return 255
+
+    # Point the absolute paths into the simulated root, and put the fake sudo/systemctl first on the PATH.
+    remote_command = remote_command.replace("/data/", host_root + "/data/")
+    remote_env = dict(os.environ)
+    remote_env["PATH"] = os.path.join(fleet_dir, ".remote-bin") + os.pathsep + remote_env.get("PATH", "")
+    remote_env["FAKE_HOST_ROOT"] = host_root
+
+    remote = subprocess.run(["bash", "-c", remote_command], cwd=host_root, env=remote_env)
+    return remote.returncode
+
+
+# Function to act as sudo. It just runs the command.
+def fake_sudo(args):
+
+    return subprocess.run(args).returncode
+
+
+# Function to normalize a unit name. format: tomcat@node1 -> tomcat@node1.service
+def unit_name(name):
+
+    return name if name.endswith(".service") else name + ".service"
+
+
+# Function to make up a stable main pid for a unit.
+def unit_pid(unit):
+
+    return 1000 + int(hashlib.md5(unit.encode()).hexdigest()[:4], 16)
+
+
+# Function to act as systemctl. The state of each unit is kept in $FAKE_HOST_ROOT/systemd/<unit>. format: "active <start epoch>" or "inactive"
+def fake_systemctl(args):
+
+    unit_dir = os.path.join(os.environ["FAKE_HOST_ROOT"], "systemd")
+    args = [arg for arg in args if not arg.startswith("--")]
+    command, units = args[0], [unit_name(unit) for unit in args[1:]]
+
+    def read_state(unit):
+        try:
+            with open(os.path.join(unit_dir, unit)) as state_file:
+                return state_file.read().split()[0]
+        except OSError:
+            return None
+
+    def write_state(unit, state):
+        with open(os.path.join(unit_dir, unit), "w") as state_file:
+            state_file.write(state + " " + str(time.time()))
+
+    if command == "list-units":
+        patterns = [arg for arg in args[1:]] or ["*"]
+        for unit in sorted(os.listdir(unit_dir)):
+            if any(fnmatch.fnmatch(unit, pattern) for pattern in patterns):
+                state = read_state(unit)
+                print(unit + " loaded " + ("active running" if state == "active" else state + " dead") + " " + unit)
+        return 0
+
+    # Only the Id and MainPID properties are simulated. Like systemd, the service properties come before the unit ones and the units are separated by a blank line. format: "show -p Id -p MainPID <unit> <unit>"
+    if command == "show":
+        blocks = []
+        for unit in [unit_name(arg) for arg in args[1:] if arg not in ["-p", "Id", "MainPID"]]:
+            blocks.append("MainPID=" + str(unit_pid(unit) if read_state(unit) == "active" else 0) + "\nId=" + unit)
+        if blocks:
+            print("\n\n".join(blocks))
+        return 0
+
+    if command == "is-active":
+        states = [read_state(unit) or "inactive" for unit in units]
+        for state in states:
+            print(state)
+        return 0 if all(state == "active" for state in states) else 3
+
+    if command in ["restart", "start", "stop"]:
+        for unit in units:
+            if read_state(unit) is None:
+                sys.stderr.write("Failed to " + command + " " + unit + ": Unit " + unit + " not found.\n")
+                return 5
+            time.sleep(restart_time if command != "stop" else restart_time / 2)
+            if random.random() < restart_failure_rate:
+                write_state(unit, "failed")
+                sys.stderr.write("Job for " + unit + " failed because the control process exited with error code.\n")
+                return 1
+            write_state(unit, "inactive" if command == "stop" else "active")
+        return 0
+
+    sys.stderr.write("Unknown command verb " + command + ".\n")
+    return 1
+
+
+# Function to act as "ss -ltnp". Every active unit listens on its port from $FAKE_HOST_ROOT/ports.json, and on a loopback shutdown port.
+def fake_ss(args):
+
+    host_root = os.environ["FAKE_HOST_ROOT"]
+    with open(os.path.join(host_root, "ports.json")) as ports_file:
+        ports = json.load(ports_file)
+
+    print("State  Recv-Q Send-Q Local Address:Port Peer Address:Port Process")
+    for unit, port in sorted(ports.items()):
+        try:
+            with open(os.path.join(host_root, "systemd", unit)) as state_file:
+                active = state_file.read().split()[0] == "active"
+        except OSError:
+            active = False
+        if active:
+            users = 'users:(("java",pid=' + str(unit_pid(unit)) + ',fd=50))'
+            print("LISTEN 0      100    *:" + str(port) + " *:* " + users)
+            print("LISTEN 0      1      [::ffff:127.0.0.1]:" + str(port + 10000) + " *:* " + users)
+    return 0
+
+
+if __name__ == "__main__":
+
+    name = os.path.basename(sys.argv[0])
+
+    if name == "sudo":
+        sys.exit(fake_sudo(sys.argv[1:]))
+    elif name == "systemctl":
+        sys.exit(fake_systemctl(sys.argv[1:]))
+    elif name == "ss":
+        sys.exit(fake_ss(sys.argv[1:]))
+    else:
+        sys.exit(fake_ssh(sys.argv[1:]))
@@ -0,0 +1,105 @@
+###########################################################################################
+# Job name:    HTTPS readiness stub for the rolling restart benchmark
+# Description: Serves the index API readiness endpoint (/api/search/webpages) for a
+#              simulated fleet. The synthetic hosts are loopback addresses, so the host
+#              is the local address a curl arrived on, and the node is found by port.
+#              A node answers once its fake systemd unit has been active for boot_time.
+# Output:      Probe counts per host, read by run_benchmark.py.
+###########################################################################################
+
+
+import json
+import os
+import ssl
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Class to handle a single curl against the stub.
+class ReadinessHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        stub = self.server.stub
+        host = self.connection.getsockname()[0]
+        node = stub.port_nodes[self.server.server_address[1]]
+        stub.count(host)
+
+        time.sleep(stub.latency)
+
+        # Read the node's fake systemd state. format: "active <start epoch>"
+        try:
+            with open(os.path.join(stub.fleet_dir, host, "systemd", node)) as state_file:
+                state, started = state_file.read().split()
+        except (OSError, ValueError):
+            state, started = "inactive", "0"
+
+        # A stopped node refuses the connection, a booting node answers 503.
+        if state != "active":
+            self.close_connection = True
+            return
+        if time.time() - float(started) < stub.boot_time:
+            self.reply(503, {"error": "The NER index is still loading."})
+        elif self.path.startswith("/api/search/webpages"):
+            self.reply(200, True)
+        else:
+            self.reply(200, {"status": "UP"})
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def reply(self, status_code, body):
+        content = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+# Class to run one HTTPS server per node port, all sharing a self-signed certificate.
+class HttpsStub:
+
+    def __init__(self, fleet_dir, port_nodes, boot_time = 1.0, latency = 0.0):
+        self.fleet_dir = fleet_dir
+        self.port_nodes = port_nodes
+        self.boot_time = boot_time
+        self.latency = latency
+        self.probes = {}
+        self.lock = threading.Lock()
+        self.servers = []
+
+    def count(self, host):
+        with self.lock:
+            self.probes[host] = self.probes.get(host, 0) + 1
+
+    def start(self):
+
+        # Generate the self-signed certificate.
+        cert_file = os.path.join(self.fleet_dir, ".stub-cert.pem")
+        key_file = os.path.join(self.fleet_dir, ".stub-key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=index-api-stub",
+                        "-keyout", key_file, "-out", cert_file], check=True, capture_output=True)
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+
+        for port in self.port_nodes:
+            server = ThreadingHTTPServer(("0.0.0.0", port), ReadinessHandler)
+            server.daemon_threads = True
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            server.stub = self
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+###########################################################################################
+# Job name:    Rolling restart benchmark
+# Description: Runs index_api.py against a simulated fleet of synthetic hosts, so changes
+#              to the scheduling can be compared without touching real hosts. ssh, sudo
+#              and systemctl are replaced by fake_ssh.py, and the readiness endpoint is
+#              served by https_stub.py. The hosts are loopback addresses (127.1.x.y).
+# Output:      Wall clock time, ssh calls per node and probes per node, to std out and
+#              optionally as JSON. The canary is off unless set, so every selected node is
+#              restarted, and a run that did not finish every node fails the benchmark.
+# Usage:       python3 benchmarks/run_benchmark.py --hosts 200 --nodes node1,node2 \
+#                  --set max_parallel_restarts=8 --set max_out_per_group=4
+###########################################################################################
+
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from https_stub import HttpsStub
+
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(benchmark_dir)
+
+# The tomcat nodes of the synthetic env, in Jenkins parameter order.
+node_names = ["node1", "node2", "node3", "node4", "node7", "node10"]
+
+
+# Function to build the synthetic host names. The hosts are loopback addresses, so curls to them reach the stub.
+def synthetic_hosts(count):
+
+    return ["127.1." + str(index // 250) + "." + str(index % 250 + 1) for index in range(count)]
+
+
+# Function to generate an inventories.json for the synthetic fleet. Half of the hosts serve the data api, the other half the index api. With paired, every other host is in prod_b instead of prod_a. The output is the inventory dictionary.
+def generate_inventory(hosts, base_port, paired = False):
+
+    half = len(hosts) // 2
+    services = {"tomcat@" + node + ".service": base_port + index for index, node in enumerate(node_names)}
+    sides = {"prod_a": hosts[0::2], "prod_b": hosts[1::2]} if paired else {"prod_a": hosts}
+
+    return {
+        "environments": {side: {"hosts": side_hosts, "split": "True", "monitor_file": "monitor.json", "services": {"index": services}} for side, side_hosts in sides.items()},
+        "functions": {
+            "data_access_layer": {"hosts": hosts[:half]},
+            "middle_tier_and_ui": {"hosts": hosts[half:]},
+        },
+        "server_type": {"children": {"vm": {"hosts": hosts[:half]}, "bm": {"hosts": hosts[half:]}}},
+    }
+
+
+# Function to lay out the simulated state of every host: an active systemd unit, its port and a live monitor.json per node.
+def build_fleet(fleet_dir, inventory):
+
+    data_hosts = set(inventory["functions"]["data_access_layer"]["hosts"])
+    services = list(inventory["environments"].values())[0]["services"]["index"]
+    booted = str(time.time() - 3600)
+
+    for host in [host for environment in inventory["environments"].values() for host in environment["hosts"]]:
+        os.makedirs(os.path.join(fleet_dir, host, "systemd"))
+        base = "base.d" if host in data_hosts else "base"
+
+        with open(os.path.join(fleet_dir, host, "ports.json"), "w") as ports_file:
+            json.dump(services, ports_file)
+
+        for node in node_names:
+            with open(os.path.join(fleet_dir, host, "systemd", "tomcat@" + node + ".service"), "w") as state_file:
+                state_file.write("active " + booted)
+
+            webapp_dir = os.path.join(fleet_dir, host, "data", "tomcat", base, node, "webapps", "ROOT")
+            os.makedirs(webapp_dir)
+            with open(os.path.join(webapp_dir, "monitor.json"), "w") as monitor_file:
+                monitor_file.write('{"active": true}\n')
+
+    # The fake sudo and systemctl are only on the PATH of the remote commands.
+    remote_bin = os.path.join(fleet_dir, ".remote-bin")
+    os.makedirs(remote_bin)
+    for name in ["sudo", "systemctl", "ss"]:
+        os.symlink(os.path.join(benchmark_dir, "fake_ssh.py"), os.path.join(remote_bin, name))
+
+
+# Function to count the lines of a log file that start with a prefix.
+def count_lines(path, prefix):
+
+    if not os.path.exists(path):
+        return 0
+    with open(path) as log_file:
+        return sum(1 for line in log_file if line.startswith(prefix))
+
+
+# Function to find the last event of a kind in the event log of the job. This returns the event dictionary, or None if there is none.
+def last_event(path, name):
+
+    found = None
+    if not os.path.exists(path):
+        return found
+    with open(path) as log_file:
+        for line in log_file:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if event.get("event") == name:
+                found = event
+    return found
+
+
+# Function to summarize the trace report written by index_api.py, if there is one. format: {"step action": {"count": n, "p50": s, "p95": s}}
+def trace_summary(trace_dir):
+
+    summary = {}
+    if not os.path.isdir(trace_dir):
+        return summary
+
+    for name in os.listdir(trace_dir):
+        if name.endswith(".json"):
+            with open(os.path.join(trace_dir, name)) as report_file:
+                for step in json.load(report_file)["steps"]:
+                    summary[(step["step"] + " " + step["action"]).strip()] = {"count": step["count"], "p50": step["p50"], "p95": step["p95"]}
+
+    return summary
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Benchmark index_api.py against a simulated fleet.")
+    parser.add_argument("--hosts", type=int, default=50, help="number of synthetic hosts")
+    parser.add_argument("--nodes", default="node1,node2", help="nodes to select on every host")
+    parser.add_argument("--action", default="restart")
+    parser.add_argument("--check-nodes", default="Yes", choices=["Yes", "No"])
+    parser.add_argument("--base-port", type=int, default=20001, help="port of node1, the other nodes follow")
+    parser.add_argument("--ssh-handshake", type=float, default=0.3, help="seconds for a new ssh connection")
+    parser.add_argument("--ssh-latency", type=float, default=0.02, help="seconds per ssh command")
+    parser.add_argument("--ssh-failure-rate", type=float, default=0.0)
+    parser.add_argument("--restart-time", type=float, default=0.5, help="seconds for systemctl restart")
+    parser.add_argument("--restart-failure-rate", type=float, default=0.0)
+    parser.add_argument("--boot-time", type=float, default=1.0, help="seconds until a restarted node answers")
+    parser.add_argument("--http-latency", type=float, default=0.0, help="seconds per readiness curl")
+    parser.add_argument("--paired", action="store_true", help="split the hosts over prod_a and prod_b")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE", help="job parameter for index_api.py, may be repeated")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="index-api-bench-")
+    fleet_dir = os.path.join(work_dir, "fleet")
+    ssh_log = os.path.join(work_dir, "ssh.log")
+    trace_dir = os.path.join(work_dir, "trace")
+
+    # Generate the inventory and the fleet.
+    hosts = synthetic_hosts(args.hosts)
+    inventory = generate_inventory(hosts, args.base_port, args.paired)
+    os.makedirs(os.path.join(work_dir, "Scripts", "inventory"))
+    with open(os.path.join(work_dir, "Scripts", "inventory", "inventories.json"), "w") as inventory_file:
+        json.dump(inventory, inventory_file)
+    build_fleet(fleet_dir, inventory)
+
+    ssh_bin = os.path.join(work_dir, "bin")
+    os.makedirs(ssh_bin)
+    os.symlink(os.path.join(benchmark_dir, "fake_ssh.py"), os.path.join(ssh_bin, "ssh"))
+
+    # Start the readiness stub.
+    port_nodes = {port: service for service, port in inventory["environments"]["prod_a"]["services"]["index"].items()}
+    stub = HttpsStub(fleet_dir, port_nodes, boot_time=args.boot_time, latency=args.http_latency)
+    stub.start()
+
+    # The Jenkins parameters. Every host is selected for each of the chosen nodes. The canary only measures a single node, so it is off unless set with --set canary=Yes.
+    selected_nodes = [node.strip() for node in args.nodes.split(",") if node.strip()]
+    event_log = os.path.join(work_dir, "events.jsonl")
+    job_env = dict(os.environ)
+    job_env.update({
+        "PATH": ssh_bin + os.pathsep + os.environ.get("PATH", ""),
+        "env": "prod_a",
+        "action": args.action,
+        "check_nodes": args.check_nodes,
+        "canary": "No",
+        "event_log": event_log,
+        "inventory_cache_dir": os.path.join(work_dir, "cache"),
+        "trace_dir": trace_dir,
+        "FAKE_FLEET_DIR": fleet_dir,
+        "FAKE_SSH_LOG": ssh_log,
+        "FAKE_SSH_HANDSHAKE": str(args.ssh_handshake),
+        "FAKE_SSH_LATENCY": str(args.ssh_latency),
+        "FAKE_SSH_FAILURE_RATE": str(args.ssh_failure_rate),
+        "FAKE_RESTART_TIME": str(args.restart_time),
+        "FAKE_RESTART_FAILURE_RATE": str(args.restart_failure_rate),
+    })
+    for node in node_names:
+        job_env[node] = ",".join(hosts) if node in selected_nodes else ""
+    for setting in args.set:
+        key, value = setting.split("=", 1)
+        job_env[key] = value
+
+    # Run the job.
+    started = time.monotonic()
+    with open(os.path.join(work_dir, "console.log"), "w") as console_log:
+        job = subprocess.run([sys.executable, os.path.join(repo_dir, "index_api.py")], cwd=work_dir, env=job_env,
+                             stdout=console_log, stderr=subprocess.STDOUT)
+    wall_time = time.monotonic() - started
+    stub.stop()
+
+    # Report. The run counts as done if its run_done event shows no failed nodes (ex. a canary that stopped the run).
+    node_count = len(hosts) * len(selected_nodes)
+    ssh_calls = count_lines(ssh_log, "ssh ")
+    probes = sum(stub.probes.values())
+    run_done = last_event(event_log, "run_done")
+    failed_nodes = len(run_done.get("failed", [])) if run_done else node_count
+    results = {
+        "hosts": len(hosts),
+        "nodes": node_count,
+        "action": args.action,
+        "settings": dict(setting.split("=", 1) for setting in args.set),
+        "exit_code": job.returncode,
+        "failed_nodes": failed_nodes,
+        "wall_time": round(wall_time, 3),
+        "seconds_per_node": round(wall_time / max(1, node_count), 3),
+        "ssh_calls": ssh_calls,
+        "ssh_calls_per_node": round(ssh_calls / max(1, node_count), 2),
+        "probes": probes,
+        "probes_per_node": round(probes / max(1, node_count), 2),
+        "steps": trace_summary(trace_dir),
+    }
+
+    print("Hosts:              " + str(results["hosts"]))
+    print("Nodes:              " + str(results["nodes"]))
+    print("Exit code:          " + str(results["exit_code"]))
+    print("Failed nodes:       " + str(failed_nodes) + ("" if run_done else " (the run did not finish)"))
+    print("Wall clock:         " + str(results["wall_time"]) + " s (" + str(results["seconds_per_node"]) + " s per node)")
+    print("SSH calls per node: " + str(results["ssh_calls_per_node"]) + " (" + str(ssh_calls) + " total)")
+    print("Probes per node:    " + str(results["probes_per_node"]) + " (" + str(probes) + " total)")
+    for step in sorted(results["steps"]):
+        timing = results["steps"][step]
+        print("  " + step.ljust(32) + " n=" + str(timing["count"]).ljust(6) + " p50=" + str(timing["p50"]).ljust(10) + " p95=" + str(timing["p95"]))
+
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if job.returncode != 0 or failed_nodes:
+        print("The job failed. See " + os.path.join(work_dir, "console.log"))
+    elif not args.keep:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    else:
+        print("Work directory: " + work_dir)
+
+    return job.returncode or (1 if failed_nodes else 0)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,15 @@
+###########################################################################################
+# Package:     index_restart
+# Description: The helpers of the Restart Index API job, importable by other jobs (sweeps,
+#              status dashboards) without starting a run. The inventory is read on first
+#              use, and requests and colorama are only imported once they are needed.
+#              ex. from index_restart.status import fleet_status
+#              The entry points take an optional Inventory, so a job can work on its own
+#              inventory without touching the shared one.
+#              ex. fleet_status(selection, inventory = Inventory("path/to/inventories.json"))
+# Modules:     console, tracing, inventory, curl, remote, discovery, elastic, journal,
+#              status, restart, plan and cli (the Jenkins entry point).
+###########################################################################################
+
+
+from .inventory import Inventory, inventory
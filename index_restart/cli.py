@@ -0,0 +1,124 @@
+###########################################################################################
+# Module:      index_restart.cli
+# Description: The Jenkins entry point of the restart job. Reads the job parameters and
+#              runs the selected action.
+###########################################################################################
+
+
+import os
+
+from .tracing import write_trace_report
+from .events import emit, events_close
+from .inventory import inventory
+from .remote import ssh_pool_close
+from .discovery import default_node_names, node_parameter_names
+from .elastic import elastic_nodes
+from .journal import journal_run_key
+from .status import fleet_status, sweep_service_ports, sweep_targets, sweep_uri
+from .restart import restart_mode, rolling_restart, bluegreen_restart
+from .plan import plan_restart
+
+
+# Function to collect Jenkins parameter selections (lists) into a dictionary. This helps parse the restart job node selections into a dctionary that can be looped through. format: {"host": ["node1", "node2"]}
+def selected_node_modifier(param_lists, node_names = None):
+
+    # The node of each parameter position.
+    if node_names is None:
+        node_names = default_node_names
+    
+    # Define a dictionary to hold the selected parameters.
+    selected_restarts = {}
+    current_node = 0 
+
+    # Loop through each node in the node_list.
+    for parameter in param_lists:
+    
+        # If any hosts were selected for the given node parameter.
+        if parameter:
+
+            # Re-format the node parameter from one long string into a split list of hosts.
+            node_parameter = parameter.split(",")
+        
+            # Loop through the node parameter for each host. 
+            for host in node_parameter:
+                
+                # Set node to the string name of the current "node" parameter. ex. "node1" or "node2"
+                node_name = "tomcat@" + node_names[current_node] + ".service"
+                
+                # If the host is not in the dictionary yet.
+                if host not in selected_restarts:
+                    # Insert the host and the node.
+                    selected_restarts.update({host: [node_name]})
+                else:
+                    # append the node only.
+                    selected_restarts[host].append(node_name)
+
+        current_node += 1
+
+    return selected_restarts
+
+
+# Function to run the job. Reads the Jenkins parameters, expands them into the selected nodes and runs the selected action on them.
+def main():
+
+    # Declare variables to pull in Jenkins parameters.
+    env = os.getenv("env")
+    action = os.getenv("action")
+    check_nodes = os.getenv("check_nodes")
+
+    # Discover the tomcat nodes of the envs hosts, so a new node only needs a Jenkins parameter of the same name. ex. "node11"
+    env_hosts = inventory["environments"][env]["hosts"] if env in inventory["environments"] else []
+    node_names = node_parameter_names(env_hosts, remote = action not in ["plan", "sweep"])
+    node_list = [os.getenv(node_name) for node_name in node_names]
+
+    # Convert the selected hosts/nodes into an iterable dictionary.
+    selected_restarts = selected_node_modifier(node_list, node_names)
+
+    # Add the elasticsearch units of the selected elasticsearch hosts, as found in the inventory (see "elastic_nodes"). format: "host1,host2"
+    elasticsearch = os.getenv("elasticsearch")
+    if elasticsearch:
+        for host in elasticsearch.split(","):
+            selected_restarts.setdefault(host, []).extend(elastic_nodes(host) or ["elasticsearch.service"])
+
+    # Start the event stream with a header for the Jenkins console.
+    emit("run_started", env = env, action = action, check_nodes = check_nodes, selected = selected_restarts, message = "*************************************************** \n   Performing the " + str(action) + " command on Selected Nodes \n***************************************************")
+
+    # If the action is "status", take a health snapshot of all the selected nodes at once. Results format: {"host": {"node": NodeStatus}}
+    action_results = {}
+    if action == "status":
+        fleet_status(selected_restarts)
+
+    # If the action is "sweep", check the service ports of the whole env, curling only what is due and reporting only what changed since the last sweep. Results format: SweepResult per (function, service type)
+    elif action == "sweep":
+        for function, service_type in sweep_targets(env):
+            sweep_service_ports(env, function, service_type, uri = sweep_uri)
+
+    # If the action is "plan", predict the restart of the selected nodes without touching them. Results format: RestartPlan
+    elif action == "plan":
+        plan_restart(selected_restarts)
+
+    # Restart the paired envs one side at a time. Results format: {"host": {"node": NodeResult}}
+    elif restart_mode == "bluegreen" and action == "restart":
+        action_results = bluegreen_restart(selected_restarts, action, check_nodes, run_key = journal_run_key(env, action, check_nodes, selected_restarts))
+
+    # Otherwise run the action as a rolling restart. Results format: {"host": {"node": NodeResult}}
+    else:
+        action_results = rolling_restart(selected_restarts, action, check_nodes, run_key = journal_run_key(env, action, check_nodes, selected_restarts))
+
+    # Close the event stream with the nodes that failed, so other jobs do not have to search for them. format: [["host", "node", "error"]]
+    failed = [[host, node, result.error] for host in action_results for node, result in action_results[host].items() if not result.success]
+    emit("run_done", env = env, action = action, status = "failed" if failed else "ok", nodes = sum(len(nodes) for nodes in action_results.values()), failed = failed)
+
+    # Close the pooled ssh connections.
+    ssh_pool_close()
+
+    # Write the per-run latency histograms, if tracing is enabled.
+    write_trace_report()
+
+    # Write out the rest of the event stream.
+    events_close()
+
+
+# To do
+# Move the check from each node restart to outside the whole big loop.
+# Integrate the muting job. Should it be something "we" do or should it be placed in the jenkinsfile? Or this script could run a curl to trigger the alert muting job.
@@ -0,0 +1,54 @@
+###########################################################################################
+# Module:      index_restart.console
+# Description: Console output of the restart job. The colorama colors (imported on first
+#              use) and the renderer that turns the event stream into the human readable
+#              Jenkins console output.
+###########################################################################################
+
+
+# Events that start a section of the console output. They are printed in blue.
+heading_events = ["run_started", "restart_order", "canary", "side", "plan"]
+
+
+# Class to stand in for colorama.Fore. colorama is only imported the first time a color is used. ex. Fore.RED
+class LazyFore:
+
+    def __getattr__(self, name):
+        from colorama import Fore as colorama_fore
+        return getattr(colorama_fore, name)
+
+
+Fore = LazyFore()
+
+
+# Class to render the event stream (see "index_restart.events") to console. Events without a message are left out, failed ones are printed in red.
+# The events of a node that is being worked on ("node_started" up to "node_done") are held back and printed as one block, so nodes worked on in parallel do not interleave.
+class ConsoleRenderer:
+
+    def __init__(self):
+        self.blocks = {}
+
+    # Print an event, or add it to the block of its node.
+    def render(self, event):
+        key = (event.get("host"), event.get("node"))
+        message = event.get("message")
+
+        if event["event"] == "node_started":
+            self.blocks[key] = []
+
+        if key in self.blocks:
+            if message is not None:
+                self.blocks[key].append(self.colored(event, message))
+            if event["event"] == "node_done":
+                print(Fore.BLUE + "\n*********** " + key[0] + " ***********" + Fore.BLACK + "\n" + "\n".join(self.blocks.pop(key)))
+
+        elif message is not None:
+            print(self.colored(event, message))
+
+    # The message of an event in its color.
+    def colored(self, event, message):
+        if event.get("status") == "failed":
+            return Fore.RED + message + Fore.BLACK
+        if event["event"] in heading_events:
+            return Fore.BLUE + message + Fore.BLACK
+        return message
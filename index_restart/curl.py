@@ -0,0 +1,334 @@
+###########################################################################################
+# Module:      index_restart.curl
+# Description: HTTP checks of the nodes: pooled keep-alive curls, the shared readiness
+#              waiter and the warm-up of restarted nodes.
+###########################################################################################
+
+
+import asyncio
+import heapq
+import itertools
+import os
+import random
+import datetime
+import functools
+import time
+import threading
+from collections import namedtuple
+from json import loads as json_loads
+from urllib.parse import quote, urlsplit
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .tracing import describe_curl, percentile, traced
+from .events import emit
+
+
+# Concurrency and timeout settings for the curl sweeps. These can be overridden with Jenkins parameters of the same name.
+sweep_workers = int(os.getenv("sweep_workers", "32"))
+sweep_per_host = int(os.getenv("sweep_per_host", "4"))
+connect_timeout = float(os.getenv("connect_timeout", "5"))
+read_timeout = float(os.getenv("read_timeout", "60"))
+
+# HTTP client settings. Each host gets one keep-alive session, with up to http_pool_size open connections. Response bodies are read up to max_body_bytes.
+http_pool_size = int(os.getenv("http_pool_size", "8"))
+max_body_bytes = int(os.getenv("max_body_bytes", "1048576"))
+# A status only curl still drains up to drain_bytes of the body, so its connection can go back to the pool.
+drain_bytes = int(os.getenv("drain_bytes", "65536"))
+http_sessions = {}
+http_sessions_lock = threading.Lock()
+
+# The result of a curl. elapsed is always a timedelta, including on connection errors. error is empty unless the curl could not complete.
+CurlResult = namedtuple("CurlResult", ["status_code", "body", "elapsed", "error"])
+
+# The endpoint curled to check that a node answers search requests.
+readiness_uri = "/api/search/webpages?keyWords=population"
+
+# Warm-up settings. Before a drained node goes back into the F5 pool, warmup_queries are replayed against it, warmup_concurrency at a time, round after round. The node is warm once a round has no errors, its p95 is below warmup_threshold seconds, and it moved less than warmup_tolerance (fraction) from the previous round.
+# A node that is not warm after warmup_deadline seconds stays out of the pool. Set warmup to "No" to put nodes back without warming them up.
+warmup = os.getenv("warmup", "Yes")
+warmup_queries = [query.strip() for query in os.getenv("warmup_queries", "population,housing,income,employment,business,education,veterans,poverty").split(",") if query.strip()]
+warmup_concurrency = int(os.getenv("warmup_concurrency", "4"))
+warmup_threshold = float(os.getenv("warmup_threshold", "2"))
+warmup_tolerance = float(os.getenv("warmup_tolerance", "0.25"))
+warmup_deadline = float(os.getenv("warmup_deadline", "300"))
+warmup_pause = float(os.getenv("warmup_pause", "2"))
+warmup_uri = "/api/search/webpages?keyWords="
+
+# The latency of a single warm-up round, in seconds. errors is the number of queries that did not return 200.
+WarmupRound = namedtuple("WarmupRound", ["p50", "p95", "p99", "errors"])
+# The outcome of warming up a node. rounds is a list of WarmupRound, reason is empty on success.
+WarmupResult = namedtuple("WarmupResult", ["success", "rounds", "reason"])
+
+# Readiness polling settings. A node is polled until it responds as expected or readiness_deadline seconds pass. The delay between curls starts at readiness_initial_delay, grows by readiness_backoff while the response stays the same (up to readiness_max_delay), and has readiness_jitter (fraction) of random jitter.
+readiness_deadline = float(os.getenv("readiness_deadline", "365"))
+readiness_initial_delay = float(os.getenv("readiness_initial_delay", "2"))
+readiness_max_delay = float(os.getenv("readiness_max_delay", "20"))
+readiness_backoff = float(os.getenv("readiness_backoff", "1.5"))
+readiness_jitter = float(os.getenv("readiness_jitter", "0.2"))
+readiness_workers = int(os.getenv("readiness_workers", "16"))
+
+# A single readiness curl. format: attempt number, status code, latency (seconds), whether the body matched, seconds since the wait started.
+ReadinessAttempt = namedtuple("ReadinessAttempt", ["attempt", "status_code", "latency", "body_match", "offset"])
+# The outcome of waiting on a node. reason is empty on success.
+ReadinessResult = namedtuple("ReadinessResult", ["success", "reason", "attempts"])
+
+
+# Function to get the keep-alive session for a host, so repeated curls reuse the TCP and TLS connections. The sessions are shared by all threads of the job.
+# requests is only imported once the first curl is sent, so the jobs that never curl start quickly.
+def http_session(host):
+
+    import requests
+
+    with http_sessions_lock:
+        session = http_sessions.get(host)
+
+        if session is None:
+            requests.packages.urllib3.disable_warnings()
+            session = requests.Session()
+            session.verify = False
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 16, pool_maxsize = http_pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            http_sessions[host] = session
+
+    return session
+
+
+# Function for sending curl's as an HTTP get. The URL input is required. Headers, JSON data and the timeout are optional. The timeout defaults to the (connect_timeout, read_timeout) settings.
+# method can be set to "HEAD", or "PUT"/"POST" with the JSON data as the body. With status_only the body is only drained (see drain_bytes) and not returned, otherwise it is read up to max_bytes (default max_body_bytes). This returns a CurlResult: name.status_code, name.body, name.elapsed (response time) and name.error.
+@traced("curl_get", describe = describe_curl)
+def curl_get(url, headers={}, json = {}, timeout = None, method = "GET", status_only = False, max_bytes = None):
+
+    import requests
+
+    # A short connect timeout keeps dead hosts from stalling, while slow responses still get the full read timeout.
+    if timeout is None:
+        timeout = (connect_timeout, read_timeout)
+    if max_bytes is None:
+        max_bytes = max_body_bytes
+
+    started = time.monotonic()
+    
+    # Open the curl command for the url. The body is streamed so it is only read as far as needed.
+    try:
+        response = http_session(urlsplit(url).hostname).request(method, url, headers=headers, json = json or None, timeout=timeout, stream=True, verify=False)
+    except requests.exceptions.RequestException as exc:
+        return CurlResult(0, "", datetime.timedelta(seconds = time.monotonic() - started), str(exc))
+
+    status_code = response.status_code
+    elapsed = response.elapsed
+    body = ""
+
+    # Read the body up to max_bytes. A status only curl only drains it, up to drain_bytes. A HEAD response has no body.
+    content = b""
+    truncated = False
+    if method != "HEAD":
+        limit = drain_bytes if status_only else max_bytes
+        try:
+            for chunk in response.iter_content(chunk_size = 65536):
+                content += chunk
+                if len(content) > limit:
+                    content = content[:limit]
+                    truncated = True
+                    break
+        except requests.exceptions.RequestException as exc:
+            response.close()
+            return CurlResult(status_code, "", datetime.timedelta(seconds = time.monotonic() - started), str(exc))
+
+    # Hand the connection back to the pool once the body is fully read. A body that was cut short is left on the connection, so that connection is closed instead.
+    if truncated:
+        response.close()
+    else:
+        response.raw.release_conn()
+
+    if not status_only and method != "HEAD":
+
+        # Determine if the response body is JSON or text. A truncated body is always kept as text.
+        text = content.decode(response.encoding or "utf-8", errors = "replace")
+        body = text
+        if "application/json" in response.headers.get("content-type", "") and not truncated:
+            try:
+                body = json_loads(text)
+            except ValueError:
+                body = text
+
+    return CurlResult(status_code, body, elapsed, "")
+
+
+# Function to send a curl from the job's event loop. The request itself runs on the loops thread pool, with the pooled session of the host. See "curl_get".
+async def async_curl_get(url, headers={}, json = {}, timeout = None, method = "GET", status_only = False, max_bytes = None):
+
+    call = functools.partial(curl_get, url, headers, json, timeout, method, status_only, max_bytes)
+
+    return await asyncio.get_running_loop().run_in_executor(None, call)
+
+
+# Class to wait on many nodes at once from a single polling loop. Each node is curled on its own adaptive schedule until it responds as expected or its deadline passes. The curls themselves run on a small thread pool.
+class ReadinessWaiter:
+
+    def __init__(self, workers = None):
+        self.condition = threading.Condition()
+        self.schedule = []
+        self.sequence = itertools.count()
+        self.pool = ThreadPoolExecutor(max_workers = workers or readiness_workers)
+        self.thread = None
+
+    # Start waiting on a node. expected_response format [http response code, response time, expected body]. deadline is in seconds. This returns a Future that resolves to a ReadinessResult as soon as the node is ready or gives up.
+    def submit(self, host, port, uri, expected_response = [200, 60, True], deadline = None):
+
+        started = time.monotonic()
+        target = {
+            "host": host,
+            "port": port,
+            "url": "https://" + host + ":" + str(port) + uri,
+            "expected_response": expected_response,
+            "started": started,
+            "deadline": started + (readiness_deadline if deadline is None else deadline),
+            "delay": readiness_initial_delay,
+            "attempts": [],
+            "future": Future(),
+        }
+
+        # The first curl goes out after the initial delay, giving the service a moment to come up.
+        self.enqueue(target, started + self.jittered(readiness_initial_delay))
+
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.loop, name = "readiness-waiter", daemon = True)
+                self.thread.start()
+
+        return target["future"]
+
+    def jittered(self, delay):
+        return delay * random.uniform(1 - readiness_jitter, 1 + readiness_jitter)
+
+    def enqueue(self, target, due):
+        with self.condition:
+            heapq.heappush(self.schedule, (min(due, target["deadline"]), next(self.sequence), target))
+            self.condition.notify()
+
+    # The polling loop. It hands each node to the pool when its next curl is due.
+    def loop(self):
+        with self.condition:
+            while True:
+                if not self.schedule:
+                    self.condition.wait()
+                    continue
+
+                due, sequence, target = self.schedule[0]
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+
+                heapq.heappop(self.schedule)
+                self.pool.submit(self.probe, target)
+
+    # Curl the node once, record the attempt (also as a "readiness_attempt" event), and either resolve the node or schedule its next curl.
+    def probe(self, target):
+
+        expected_response = target["expected_response"]
+        sent = time.monotonic()
+        try:
+            curl_response = curl_get(target["url"], headers={}, json = {})
+        except Exception as exc:
+            curl_response = CurlResult(0, "", datetime.timedelta(seconds = time.monotonic() - sent), str(exc))
+        now = time.monotonic()
+
+        latency = now - sent
+        body_match = curl_response.body == expected_response[2]
+        attempts = target["attempts"]
+        attempts.append(ReadinessAttempt(len(attempts) + 1, curl_response.status_code, round(latency, 3), body_match, round(now - target["started"], 3)))
+        emit("readiness_attempt", host = target["host"], port = target["port"], attempt = attempts[-1].attempt, status_code = curl_response.status_code, latency = attempts[-1].latency, body_match = body_match, offset = attempts[-1].offset)
+
+        # If the curl responds as expected.
+        if curl_response.status_code == expected_response[0] and body_match and latency < expected_response[1]:
+            target["future"].set_result(ReadinessResult(True, "", attempts))
+            return
+
+        # Out of time.
+        if now >= target["deadline"]:
+            reason = str(len(attempts)) + " curls over " + str(round(now - target["started"])) + " seconds. Last response:" + "\nStatus Code: " + str(curl_response.status_code) + "\nResponse Time: " + str(round(latency, 3)) + "\nResponse Body: " + (str(curl_response.body) or curl_response.error)[:500]
+            target["future"].set_result(ReadinessResult(False, reason, attempts))
+            return
+
+        # Back off while the node keeps giving the same answer. A different answer means it is making progress, so poll quickly again.
+        if len(attempts) > 1 and attempts[-2].status_code != curl_response.status_code:
+            target["delay"] = readiness_initial_delay
+        else:
+            target["delay"] = min(target["delay"] * readiness_backoff, readiness_max_delay)
+
+        self.enqueue(target, now + self.jittered(target["delay"]))
+
+
+# The shared waiter for the job, created on first use.
+readiness_waiter_instance = None
+readiness_waiter_lock = threading.Lock()
+
+
+# Function to get the shared ReadinessWaiter, so all nodes of the job are tracked by one polling loop.
+def readiness_waiter():
+    global readiness_waiter_instance
+
+    with readiness_waiter_lock:
+        if readiness_waiter_instance is None:
+            readiness_waiter_instance = ReadinessWaiter()
+        return readiness_waiter_instance
+
+
+# Function to wait on many nodes at once, on the job's event loop. targets is a list of (host, port, uri). The polling happens on the ReadinessWaiter thread; this only awaits its results. The output is a dictionary of {target: ReadinessResult}.
+async def async_wait_until_ready(targets, expected_response = [200, 60, True], deadline = None):
+
+    waiter = readiness_waiter()
+    futures = [asyncio.wrap_future(waiter.submit(target[0], target[1], target[2], expected_response, deadline)) for target in targets]
+    results = await asyncio.gather(*futures)
+
+    return dict(zip(targets, results))
+
+
+# Function to curl a single host, port, or service until it responds as expected. duration is kept for compatibility, and sets the deadline to the old worst case (15 seconds + duration x 10 seconds). expected_response format [http response code, response time, expected body]. This returns name.success, name.reason, and name.attempts.
+@traced("curl_loop", describe = lambda values: (values.get("host"), str(values.get("port")), "readiness"))
+def curl_loop(host, port, uri, expected_response = [200, 60, True], duration = 35):
+
+    return readiness_waiter().submit(host, port, uri, expected_response, deadline = 15 + duration * 10).result()
+
+
+# Function to warm up a node after a restart, by replaying the representative warmup_queries against it concurrently until its latency converges below warmup_threshold. Without any queries the node can not be warmed up and fails right away. This returns a WarmupResult: name.success, name.rounds, name.reason.
+@traced("warm_up_node", describe = lambda values: (values.get("host"), str(values.get("port")), "warmup"))
+def warm_up_node(host, port, queries = None, deadline = None):
+
+    queries = warmup_queries if queries is None else queries
+    if not queries:
+        return WarmupResult(False, [], "There are no warm-up queries (see warmup_queries), so the node can not be warmed up.")
+
+    deadline = time.monotonic() + (warmup_deadline if deadline is None else deadline)
+    base_url = "https://" + host + ":" + str(port) + warmup_uri
+    rounds = []
+
+    with ThreadPoolExecutor(max_workers = max(1, warmup_concurrency)) as pool:
+        while True:
+
+            # Replay the queries and collect the latency of the good responses.
+            responses = list(pool.map(lambda query: curl_get(base_url + quote(query), status_only = True), queries))
+            latencies = sorted(response.elapsed.total_seconds() for response in responses if response.status_code == 200)
+            errors = len(responses) - len(latencies)
+
+            if latencies:
+                rounds.append(WarmupRound(round(percentile(latencies, 0.5), 3), round(percentile(latencies, 0.95), 3), round(percentile(latencies, 0.99), 3), errors))
+            else:
+                rounds.append(WarmupRound(None, None, None, errors))
+
+            # Warm once a clean round is under the threshold, and steady compared to the round before.
+            current = rounds[-1]
+            if len(rounds) > 1 and current.errors == 0 and current.p95 < warmup_threshold:
+                previous = rounds[-2]
+                if previous.errors == 0 and abs(current.p95 - previous.p95) <= warmup_tolerance * max(previous.p95, 0.001):
+                    return WarmupResult(True, rounds, "")
+
+            if time.monotonic() >= deadline:
+                reason = "The node did not warm up after " + str(len(rounds)) + " rounds. Last round: p50 " + str(current.p50) + "s, p95 " + str(current.p95) + "s, p99 " + str(current.p99) + "s, " + str(current.errors) + " errors."
+                return WarmupResult(False, rounds, reason)
+
+            # Give a node that is still failing a moment before the next round.
+            if errors:
+                time.sleep(warmup_pause)
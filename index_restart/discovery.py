@@ -0,0 +1,192 @@
+###########################################################################################
+# Module:      index_restart.discovery
+# Description: Discovery of the tomcat units and their ports on each host, kept in a TTL
+#              cache on disk.
+###########################################################################################
+
+
+import asyncio
+import json
+import os
+import time
+import re
+import threading
+
+from .tracing import traced
+from .inventory import inventory_cache_dir, use_inventory
+from .remote import async_ssh_run, run_async
+
+
+# Node discovery settings. The tomcat units on each host and the ports they listen on are discovered with one remote call per host, and kept in discovery_cache_dir for discovery_ttl seconds. The Jenkins node parameters and the service ports are read from it, falling back to default_node_names and the inventory.
+# Set discovery to "No" to only use the defaults and the inventory.
+discovery = os.getenv("discovery", "Yes")
+discovery_ttl = float(os.getenv("discovery_ttl", "3600"))
+discovery_cache_dir = os.getenv("discovery_cache_dir", inventory_cache_dir)
+default_node_names = ["node1", "node2", "node3", "node4", "node7", "node10"]
+discovery_marker = "--listeners--"
+discovery_cache = {}
+discovery_cache_loaded = False
+discovery_lock = threading.Lock()
+
+
+# Function to build the remote command that lists the tomcat units of a host in one call: the Id and MainPID of each unit, then the listening sockets with their pids.
+def discovery_command():
+
+    return ("tomcat_units() { "
+            "units=$(systemctl list-units --all --plain --no-legend 'tomcat@*.service' | awk '{print $1}'); "
+            "[ -z \"$units\" ] || systemctl show -p Id -p MainPID $units; "
+            "echo " + discovery_marker + "; sudo ss -ltnp; }; tomcat_units")
+
+
+# Function to parse the output of "discovery_command". The ports of a unit are the listening ports of its main pid that are not bound to loopback (tomcats shutdown port is). The output is a dictionary of {"unit": [port]}, the list is empty if the unit is not running.
+def parse_discovery(stdout):
+
+    lines = stdout.splitlines()
+    split = lines.index(discovery_marker) if discovery_marker in lines else len(lines)
+
+    # The public listening ports of each pid. format: {"pid": [port]}
+    pid_ports = {}
+    for line in lines[split + 1:]:
+        fields = line.split()
+        if len(fields) < 4 or fields[0] != "LISTEN":
+            continue
+        address, _, port = fields[3].rpartition(":")
+        if not port.isdigit() or address.strip("[]").replace("::ffff:", "") in ["127.0.0.1", "::1", "localhost"]:
+            continue
+        for pid in re.findall(r"pid=(\d+),", line):
+            pid_ports.setdefault(pid, []).append(int(port))
+
+    # systemctl show prints one block of "key=value" lines per unit, separated by blank lines. The order of the properties within a block is up to systemd (MainPID comes before Id), so a block is only read once it is complete.
+    blocks = [{}]
+    for line in lines[:split]:
+        key, separator, value = line.strip().partition("=")
+        if not separator or key in blocks[-1]:
+            blocks.append({})
+        if separator:
+            blocks[-1][key] = value
+
+    units = {}
+    for properties in blocks:
+        unit = properties.get("Id", "")
+        if unit.startswith("tomcat@"):
+            units[unit] = sorted(set(pid_ports.get(properties.get("MainPID", "0"), [])))
+
+    return units
+
+
+# Function to read the discovery cache file into memory. Entries older than discovery_ttl are dropped.
+def load_discovery_cache():
+    global discovery_cache_loaded
+
+    oldest = time.time() - discovery_ttl
+
+    try:
+        with open(os.path.join(discovery_cache_dir, "discovery.json")) as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        cached = {}
+
+    with discovery_lock:
+        for host, entry in cached.items():
+            if isinstance(entry, dict) and entry.get("time", 0) >= oldest and host not in discovery_cache:
+                discovery_cache[host] = entry
+        discovery_cache_loaded = True
+
+
+# Function to write the in memory discovery cache to disk atomically. A failure here only costs the next run a rediscovery.
+def save_discovery_cache():
+
+    cache_file = os.path.join(discovery_cache_dir, "discovery.json")
+    with discovery_lock:
+        cached = dict(discovery_cache)
+
+    try:
+        os.makedirs(discovery_cache_dir, mode=0o700, exist_ok=True)
+        temp_file = cache_file + "." + str(os.getpid())
+        with open(temp_file, "w") as snapshot_file:
+            json.dump(cached, snapshot_file, separators=(",", ":"))
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+
+# Function to discover the tomcat units of a host, on the job's event loop. This returns {"unit": [port]}, or None if the remote call failed.
+@traced("discover_host", describe = lambda values: (values.get("host"), None, "discover"))
+async def async_discover_host(host):
+
+    discover_cmd = await async_ssh_run(host, discovery_command())
+    if discover_cmd.returncode == 255 or discovery_marker not in discover_cmd.stdout:
+        return None
+
+    return parse_discovery(discover_cmd.stdout)
+
+
+# Function to discover the tomcat units of many hosts at once. Hosts with a fresh cache entry are not contacted, unless refresh is True. Hosts that could not be reached keep their last entry, if any. With remote False only the cache is read.
+# The output is a dictionary of {"host": {"unit": [port]}}, without the hosts that are not known.
+def discover_nodes(hosts, refresh = False, remote = True):
+
+    if discovery != "Yes":
+        return {}
+
+    load_discovery_cache()
+    with discovery_lock:
+        stale = [host for host in hosts if remote and (refresh or host not in discovery_cache)]
+
+    if stale:
+        async def discover_all():
+            return await asyncio.gather(*[async_discover_host(host) for host in stale])
+
+        now = round(time.time(), 3)
+        for host, units in zip(stale, run_async(discover_all())):
+            if units is not None:
+                with discovery_lock:
+                    discovery_cache[host] = {"time": now, "units": units}
+        save_discovery_cache()
+
+    return {host: discovered_nodes(host) for host in hosts if discovered_nodes(host) is not None}
+
+
+# Function to look up the discovered tomcat units of a host, without any remote calls. The cache file is read on the first lookup, so library callers see the discoveries of earlier runs. This returns {"unit": [port]}, or None if the host has no fresh cache entry.
+def discovered_nodes(host):
+
+    if discovery != "Yes":
+        return None
+
+    if not discovery_cache_loaded:
+        load_discovery_cache()
+
+    with discovery_lock:
+        entry = discovery_cache.get(host)
+
+    if entry is None or entry.get("time", 0) < time.time() - discovery_ttl:
+        return None
+
+    return entry["units"]
+
+
+# Function to determine the service port of a node on a host. The inventory port of the hosts env always wins, a tomcat also listens on its plain http connector, so a discovered port is only used for a node the inventory does not list and only if it is the nodes single public port. This returns None otherwise.
+def node_port(host, env, node, inventory = None):
+
+    inventory = use_inventory(inventory)
+    port = inventory["environments"][env]["services"]["index"].get(node)
+    if port:
+        return port
+
+    units = discovered_nodes(host) or {}
+    if len(units.get(node) or []) == 1:
+        return units[node][0]
+
+    return None
+
+
+# Function to list the node parameter names of the Jenkins job, ex. "node1". These are default_node_names plus any node discovered on the given hosts, in natural order (node2 before node10). With remote False only the discovery cache is read.
+def node_parameter_names(hosts, remote = True):
+
+    names = set(default_node_names)
+    for units in discover_nodes(hosts, remote = remote).values():
+        for unit in units:
+            short_name = re.search(r"(?<=@)(.*)\.service$", unit)
+            if short_name:
+                names.add(short_name.group(1))
+
+    return sorted(names, key = lambda name: [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)])
@@ -0,0 +1,60 @@
+###########################################################################################
+# Module:      index_restart.elastic
+# Description: The elasticsearch units of a host and calls to their cluster API.
+###########################################################################################
+
+
+import os
+import time
+
+from .inventory import use_inventory
+from .curl import curl_get, readiness_backoff, readiness_initial_delay, readiness_max_delay
+
+
+# Elasticsearch settings. Elasticsearch nodes are restarted one at a time per env: shard allocation is limited to primaries and the node is flushed before the restart, and allocation is re-enabled once the node rejoined. The next node only starts once _cluster/health is green again, or elastic_deadline seconds pass.
+# The units and their ports come from the services of the hosts env in the inventory. A vm host runs elasticsearch on elastic_vm_port, a bm host runs its own elasticsearch units next to the tomcat nodes (see "check_service_port").
+elastic_deadline = float(os.getenv("elastic_deadline", "1800"))
+elastic_vm_port = 9200
+
+
+# Function to find the elasticsearch units of a host and their API ports, from the services of its env. On a vm host that is the unit on elastic_vm_port, on a bm host every elasticsearch unit except the vm one ("elasticsearch.service"). The output is a dictionary of {"unit": port}, empty if the host has none.
+def elastic_nodes(host, inventory = None):
+
+    inventory = use_inventory(inventory)
+    env = inventory.index.host_env.get(host)
+    if env is None:
+        return {}
+    server_type = inventory.index.host_server_type.get(host)
+
+    nodes = {}
+    for services in inventory["environments"][env].get("services", {}).values():
+        for service, port in services.items():
+            if not service.startswith("elasticsearch"):
+                continue
+            if server_type == "vm" and port != elastic_vm_port:
+                continue
+            if server_type == "bm" and service == "elasticsearch.service":
+                continue
+            nodes[service] = port
+
+    return nodes
+
+
+# Function to call the elasticsearch API of a host on the port of one of its units (see "elastic_nodes"). path is the API path, ex. "/_cluster/health". This returns a CurlResult.
+def elastic_api(host, port, path, method = "GET", body = {}):
+
+    return curl_get("https://" + host + ":" + str(port) + path, json = body, method = method)
+
+
+# Function to poll the elasticsearch API of a host until check(CurlResult) is true or the deadline (monotonic time) passes. The delay between calls backs off like the readiness polling. This returns the last CurlResult and whether the check passed.
+def elastic_wait(host, port, path, check, deadline):
+
+    delay = readiness_initial_delay
+    while True:
+        response = elastic_api(host, port, path)
+        if check(response):
+            return response, True
+        if time.monotonic() >= deadline:
+            return response, False
+        time.sleep(min(delay, max(0, deadline - time.monotonic())))
+        delay = min(delay * readiness_backoff, readiness_max_delay)
@@ -0,0 +1,125 @@
+###########################################################################################
+# Module:      index_restart.events
+# Description: The event stream of the restart job. Every lifecycle event (probe result,
+#              drain, restart, readiness attempt, reinsert) is written as one JSON object
+#              per line, and the console output is rendered from the same events.
+###########################################################################################
+
+
+import atexit
+import itertools
+import json
+import os
+import queue
+import stat
+import sys
+import time
+import threading
+
+from .console import ConsoleRenderer
+from .tracing import trace_run_id
+
+
+# Event settings. The events are written to event_log, a file or a named pipe, one JSON object per line. Leave it empty to only render the console output.
+# The workers only queue their events. A single writer thread writes and renders them, up to event_batch at a time, and flushes once per batch.
+event_log = os.getenv("event_log", "")
+event_batch = int(os.getenv("event_batch", "500"))
+
+
+# Class to buffer the events of the job and write them from a single writer thread, so the workers never wait on the file, the pipe or the console. The writer starts with the first event, and "close" writes out whatever is still queued.
+# Each event is a dictionary. format: {"ts": epoch seconds, "seq": n, "run": trace_run_id, "event": "name", "host": "host", "node": "node", "status": "ok" or "failed", "message": "console text", ...}
+class EventStream:
+
+    def __init__(self, path = None, console = True):
+        self.path = event_log if path is None else path
+        self.renderer = ConsoleRenderer() if console else None
+        self.queue = queue.Queue()
+        self.sequence = itertools.count(1)
+        self.lock = threading.Lock()
+        self.thread = None
+        self.registered = False
+
+    # Queue an event. Fields that are None are left out.
+    def emit(self, event, **fields):
+        record = {"ts": round(time.time(), 3), "run": trace_run_id, "event": event}
+        record.update((name, value) for name, value in fields.items() if value is not None)
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target = self.write, name = "event-writer", daemon = True)
+                self.thread.start()
+                if not self.registered:
+                    atexit.register(self.close)
+                    self.registered = True
+            record["seq"] = next(self.sequence)
+            self.queue.put(record)
+
+    # The writer thread. A named pipe needs its reader to be attached already, so the job never hangs on it. If the log can not be written, the console output goes on without it.
+    def write(self):
+        log_file = None
+        if self.path:
+            try:
+                if os.path.exists(self.path) and stat.S_ISFIFO(os.stat(self.path).st_mode):
+                    pipe = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+                    os.set_blocking(pipe, True)
+                    log_file = os.fdopen(pipe, "w")
+                else:
+                    log_file = open(self.path, "a")
+            except OSError as exc:
+                sys.stderr.write("The event log " + self.path + " can not be opened: " + str(exc) + "\n")
+
+        done = False
+        while not done:
+            batch = [self.queue.get()]
+            while len(batch) < event_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for record in batch:
+                if record is None:
+                    done = True
+                    continue
+                if log_file:
+                    try:
+                        log_file.write(json.dumps(record, default = str) + "\n")
+                    except OSError:
+                        log_file = None
+                if self.renderer:
+                    self.renderer.render(record)
+
+            if log_file:
+                try:
+                    log_file.flush()
+                except OSError:
+                    log_file = None
+            sys.stdout.flush()
+
+        if log_file:
+            log_file.close()
+
+    # Write out the queued events and stop the writer. A later event starts a new one.
+    def close(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread:
+                self.queue.put(None)
+        if thread:
+            thread.join()
+
+
+# The event stream of the job.
+event_stream = EventStream()
+
+
+# Function to add an event to the event stream of the job. ex. emit("restart", host = host, node = node, status = "ok", message = "The restart command was successful.")
+def emit(event, **fields):
+
+    event_stream.emit(event, **fields)
+
+
+# Function to write out the queued events at the end of the job.
+def events_close():
+
+    event_stream.close()
@@ -0,0 +1,222 @@
+###########################################################################################
+# Module:      index_restart.inventory
+# Description: The inventory of envs, hosts and functions
+#              (Scripts/inventory/inventories.json), loaded on first use and cached as a
+#              snapshot, and the host profiles built from it.
+###########################################################################################
+
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import namedtuple
+
+
+# Inventory settings. The parsed inventory and its lookup index are cached in inventory_cache_dir, keyed on the inventory file.
+inventory_path = "Scripts/inventory/inventories.json"
+inventory_cache_dir = os.getenv("inventory_cache_dir", os.path.join(os.path.expanduser("~"), ".cache", "index_api"))
+
+# Lookup tables built from the inventory. format: host_env {"host": "env"}, host_functions {"host": ["function"]}, host_server_type {"host": "vm"}, env_function_hosts {("env", "function"): ["host"]}
+InventoryIndex = namedtuple("InventoryIndex", ["host_env", "host_functions", "host_server_type", "env_function_hosts"])
+
+# The functions whose nodes are behind the F5 pool, and the function of the elasticsearch hosts.
+f5_functions = ["data_access_layer", "middle_tier_and_ui"]
+elastic_function = "elastic_index_layer"
+
+
+# Function to determine a hosts environment, monitor file, and whether the hosts environment is split or not. The Input is a hostname, and optionally the Inventory to look it up in (the inventory of the job by default). The output is a tuple of ["env", "split_env", "monitor_file", function]
+def server_profile(hostname, inventory = None):
+
+    inventory = use_inventory(inventory)
+
+   # Define some info about the host.
+    env = ""
+    split_env = ""
+    monitor_file = ""
+    function = []
+    error = "The host profile is incomplete."
+
+    # Define the applicable environments.
+    prodops_envs = ["prod_a", "prod_b", "embargo", "at", "preprod", "fr_a", "fr_b", "er_a", "er_b"]
+
+    # Look up the hosts environment in the inventory index.
+    environment = inventory.index.host_env.get(hostname)
+    if environment in prodops_envs:
+
+        # Extract variables from the match.
+        env = environment
+        # Helps determine monitor.json, and whether or not a node needs to be removed from the F5 pool.
+        split_env = inventory["environments"][environment]["split"]
+        monitor_file = inventory["environments"][environment]["monitor_file"]
+    else:
+        error = "The host was not found in any environment."
+
+
+    # Determine the hosts function. 
+    function = list(inventory.index.host_functions.get(hostname, []))
+    if not function:
+        error = "The hosts function could not be found."
+
+
+    # If all variables were assigned.
+    if env and split_env and monitor_file and function:
+
+        # Make the variables callable.
+        result = namedtuple("result", ["env", "split_env", "monitor_file", "function"])
+        return result(env, split_env, monitor_file, function)
+    else:
+       return error
+
+
+# Function to build the inventory lookup tables. Each table is built once, so host checks are dictionary lookups instead of list scans. The input is the parsed inventory. The output is an InventoryIndex.
+def build_inventory_index(inventory):
+
+    # Map each host to its environment.
+    host_env = {}
+    for environment in inventory["environments"]:
+        for host in inventory["environments"][environment]["hosts"]:
+            host_env[host] = environment
+
+    # Map each host to its functions, in inventory order.
+    host_functions = {}
+    for serv_type in inventory["functions"]:
+        for host in inventory["functions"][serv_type]["hosts"]:
+            host_functions.setdefault(host, []).append(serv_type)
+
+    # Map each host to its server type (vm or bm).
+    host_server_type = {}
+    server_types = inventory.get("server_type", {}).get("children", {})
+    for server_type in server_types:
+        for host in server_types[server_type].get("hosts", []):
+            host_server_type[host] = server_type
+
+    # Map each (env, function) pair to its hosts, in the env's host order.
+    env_function_hosts = {}
+    for environment in inventory["environments"]:
+        for host in inventory["environments"][environment]["hosts"]:
+            for serv_type in host_functions.get(host, []):
+                env_function_hosts.setdefault((environment, serv_type), []).append(host)
+
+    return InventoryIndex(host_env, host_functions, host_server_type, env_function_hosts)
+
+
+# Function to load the inventory file and its index. The result is cached as a snapshot in inventory_cache_dir. The snapshot is reused as-is while the file's mtime and size are unchanged, and after that only if the file's sha256 still matches. The output is a tuple of (inventory, inventory_index).
+def load_inventory(path = inventory_path, cache_dir = None):
+
+    if cache_dir is None:
+        cache_dir = inventory_cache_dir
+
+    # One snapshot per inventory file.
+    stat = os.stat(path)
+    stamp = [stat.st_mtime_ns, stat.st_size]
+    cache_file = os.path.join(cache_dir, "inventory-" + hashlib.sha256(os.path.abspath(path).encode()).hexdigest()[:16] + ".pickle")
+
+    # Read the previous snapshot, if there is a usable one.
+    snapshot = None
+    try:
+        with open(cache_file, "rb") as snapshot_file:
+            snapshot = pickle.load(snapshot_file)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        snapshot = None
+
+    if snapshot and snapshot.get("stamp") == stamp:
+        return snapshot["inventory"], InventoryIndex(**snapshot["index"])
+
+    # The file was touched. Only re-parse it if the contents changed.
+    with open(path, "rb") as inventory_file:
+        raw = inventory_file.read()
+    digest = hashlib.sha256(raw).hexdigest()
+
+    if snapshot and snapshot.get("sha256") == digest:
+        inventory = snapshot["inventory"]
+        index = InventoryIndex(**snapshot["index"])
+    else:
+        inventory = json.loads(raw)
+        index = build_inventory_index(inventory)
+
+    # Write the snapshot atomically. A failure here only costs the next run a re-parse.
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        temp_file = cache_file + "." + str(os.getpid())
+        with open(temp_file, "wb") as snapshot_file:
+            pickle.dump({"stamp": stamp, "sha256": digest, "inventory": inventory, "index": dict(index._asdict())}, snapshot_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+    return inventory, index
+
+
+# Function to determine the F5 function of a host, which is the group its nodes are drained under. The input is the function list from "server_profile". This returns "data_access_layer", "middle_tier_and_ui" or None.
+def f5_function(function):
+
+    for serv_type in f5_functions:
+        if serv_type in function:
+            return serv_type
+
+    return None
+
+
+# Function to determine the group function of a node: "elastic_index_layer" for an elasticsearch unit on an elastic host, otherwise its F5 function (see "f5_function").
+def job_function(node, function):
+
+    if elastic_function in function and node.startswith("elasticsearch"):
+        return elastic_function
+
+    return f5_function(function)
+
+
+# Class to hold the inventory and its lookup index. Nothing is read until the inventory is first used, so importing the package is cheap. It can be used like the parsed inventory. ex. inventory["environments"], inventory.index.host_env
+class Inventory:
+
+    def __init__(self, path = None, cache_dir = None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    # Read the inventory file (or its snapshot) on first use. This returns the Inventory.
+    def load(self):
+        if self.loaded is None:
+            with self.lock:
+                if self.loaded is None:
+                    self.loaded = load_inventory(self.path or inventory_path, self.cache_dir)
+        return self
+
+    # Forget the loaded inventory, so the next use reads the file again. path and cache_dir point it at another inventory.
+    def reset(self, path = None, cache_dir = None):
+        with self.lock:
+            self.path = path
+            self.cache_dir = cache_dir
+            self.loaded = None
+
+    # The parsed inventory file.
+    @property
+    def data(self):
+        return self.load().loaded[0]
+
+    # The InventoryIndex of the inventory.
+    @property
+    def index(self):
+        return self.load().loaded[1]
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def get(self, key, default = None):
+        return self.data.get(key, default)
+
+
+# The inventory of the job. Another job can point it at its own file before using it. ex. inventory.reset("path/to/inventories.json")
+inventory = Inventory()
+
+
+# Function to pick the inventory a lookup runs against: the given Inventory, or the inventory of the job if it is None. ex. inventory = use_inventory(inventory)
+def use_inventory(source = None):
+
+    return inventory if source is None else source
@@ -0,0 +1,143 @@
+###########################################################################################
+# Module:      index_restart.journal
+# Description: The JSON-lines progress journal: node state transitions, resume of
+#              unfinished runs and the timings of past runs.
+###########################################################################################
+
+
+import hashlib
+import json
+import os
+import time
+import threading
+from collections import namedtuple
+
+from .tracing import percentile
+from .inventory import job_function, use_inventory
+
+
+# Progress journal settings. Every node state transition (started, drained, restarted, healthy, warm, reinserted, done, failed) is appended to journal_file, so a rerun of the same job within resume_window hours can skip the completed nodes and finish the half-done ones. Set resume to "No" to start over.
+journal_file = os.getenv("journal_file", "index_api_journal.jsonl")
+resume = os.getenv("resume", "Yes")
+resume_window = float(os.getenv("resume_window", "24"))
+journal_lock = threading.Lock()
+
+# The past durations of a function group, in seconds. restart is start to restarted, readiness is restarted to healthy, cycle is start to reinserted or done.
+NodeTimings = namedtuple("NodeTimings", ["samples", "restart_p50", "readiness_p50", "cycle_p50", "cycle_p95"])
+
+# The last known state of a node in the journal. f5_removal is whether the run took the node out of the F5 pool at any point.
+JournalEntry = namedtuple("JournalEntry", ["state", "f5_removal"])
+
+
+# Function to build the journal key of a run. Reruns of the same job (env, action, check_nodes and node selection) share the key. The output is a short hex string.
+def journal_run_key(env, action, check_nodes, selected_restarts):
+
+    selection = sorted((host, sorted(nodes)) for host, nodes in selected_restarts.items())
+    return hashlib.sha256(json.dumps([env, action, check_nodes, selection]).encode()).hexdigest()[:16]
+
+
+# Function to append a state transition to the journal. One compact JSON object per line. format: {"run": "key", "time": epoch, "host": "host", "node": "node", "state": "drained", "f5": true}
+def journal_record(run_key, host, node, state, f5_removal = False, path = None):
+
+    entry = json.dumps({"run": run_key, "time": round(time.time(), 3), "host": host, "node": node, "state": state, "f5": f5_removal}, separators=(",", ":"))
+
+    with journal_lock:
+        with open(path or journal_file, "a") as journal:
+            journal.write(entry + "\n")
+
+
+# Function to close a run in the journal once every node succeeded, so the next run starts fresh. The input is the action results of the run. format: {"host": {"node": NodeResult}}
+def journal_close(run_key, action_results):
+
+    if all(result.success for host in action_results for result in action_results[host].values()):
+        journal_record(run_key, None, None, "complete")
+
+
+# Function to read the state of each node in the latest unfinished attempt of a run from the journal. Entries before the runs last "complete", entries older than resume_window hours, and a partly written last line are ignored. The output is a dictionary of {("host", "node"): JournalEntry}.
+def journal_load(run_key, path = None):
+
+    nodes = {}
+    oldest = time.time() - resume_window * 3600
+
+    try:
+        with open(path or journal_file) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+
+                if entry.get("run") != run_key or entry.get("time", 0) < oldest:
+                    continue
+                if entry.get("state") == "complete":
+                    nodes = {}
+                    continue
+
+                # "started" only marks the timing of an attempt, the node keeps its progress.
+                if entry.get("state") == "started":
+                    continue
+
+                key = (entry["host"], entry["node"])
+                f5_removal = entry.get("f5", False) or (key in nodes and nodes[key].f5_removal)
+                nodes[key] = JournalEntry(entry["state"], f5_removal)
+    except OSError:
+        pass
+
+    return nodes
+
+
+# Function to read the past node timings from the journal, per function group. A cycle starts with the "started" entry of a node (or its first entry, for older journals) and ends with its "reinserted" or "done" entry. Failed cycles are left out.
+# Hosts that are no longer in the inventory are skipped. The output is a dictionary of {"function": NodeTimings}.
+def journal_timings(path = None, inventory = None):
+
+    inventory = use_inventory(inventory)
+
+    # The entries of each node attempt. format: {("run", "host", "node"): [(time, "state")]}
+    attempts = {}
+    try:
+        with open(path or journal_file) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("host"):
+                    attempts.setdefault((entry.get("run"), entry["host"], entry.get("node")), []).append((entry.get("time", 0), entry.get("state")))
+    except OSError:
+        pass
+
+    # The durations of each function. format: {"function": {"restart": [], "readiness": [], "cycle": []}}
+    samples = {}
+    for (run, host, node), entries in attempts.items():
+        if host not in inventory.index.host_functions:
+            continue
+        function = job_function(node, inventory.index.host_functions[host])
+
+        start = None
+        marks = {}
+        for time_stamp, state in sorted(entries, key = lambda item: item[0]):
+            if state == "started" or start is None:
+                start, marks = time_stamp, {}
+            if state == "failed":
+                start = None
+                continue
+            marks.setdefault(state, time_stamp)
+
+            # A finished cycle.
+            if state in ["reinserted", "done"]:
+                durations = samples.setdefault(function, {"restart": [], "readiness": [], "cycle": []})
+                durations["cycle"].append(time_stamp - start)
+                if "restarted" in marks:
+                    durations["restart"].append(marks["restarted"] - start)
+                    if "healthy" in marks:
+                        durations["readiness"].append(marks["healthy"] - marks["restarted"])
+                start = None
+
+    timings = {}
+    for function, durations in samples.items():
+        cycles = sorted(durations["cycle"])
+        restarts = sorted(durations["restart"])
+        readiness = sorted(durations["readiness"])
+        timings[function] = NodeTimings(len(cycles), percentile(restarts, 0.5) if restarts else None, percentile(readiness, 0.5) if readiness else None, percentile(cycles, 0.5), percentile(cycles, 0.95))
+
+    return timings
@@ -0,0 +1,198 @@
+###########################################################################################
+# Module:      index_restart.plan
+# Description: The restart planner. Predicts the schedule and duration of a restart from
+#              the journal, without any remote commands.
+###########################################################################################
+
+
+import heapq
+import itertools
+import os
+import datetime
+from collections import namedtuple
+
+from .events import emit
+from .inventory import elastic_function, f5_functions
+from .journal import journal_file, journal_timings
+from .restart import CapacityGuard, bluegreen_sides, canary, host_live_nodes, max_out_overrides, max_out_per_group, max_parallel_restarts, parse_group_limits, restart_jobs, restart_mode, restart_order
+
+
+# Planner settings. The "plan" action predicts the schedule and duration of a restart from the journal of past runs, without any remote commands. Nodes without history are assumed to take plan_default_node_seconds.
+# The recommended concurrency is the lowest that fits the restart into plan_window minutes.
+plan_window = float(os.getenv("plan_window", "60"))
+plan_default_node_seconds = float(os.getenv("plan_default_node_seconds", "180"))
+# The time the latency probes before the restarts are assumed to take (see restart_order and canary).
+plan_probe_seconds = float(os.getenv("plan_probe_seconds", "10"))
+
+# A node in the simulated schedule. start and end are seconds from the start of the run.
+PlannedJob = namedtuple("PlannedJob", ["job", "start", "end"])
+# The outcome of the planner. waves is a list of [PlannedJob] that start together, drain_set is {("env", "function"): [RestartJob]}, blocked is [(RestartJob, reason)], predicted and predicted_p95 are seconds, recommendation is (max_parallel_restarts, max_out_per_group) or None.
+RestartPlan = namedtuple("RestartPlan", ["waves", "drain_set", "blocked", "predicted", "predicted_p95", "recommendation"])
+
+
+# Function to simulate the rolling restart scheduler (see "rolling_restart") with the predicted duration of each job. The live nodes follow "host_live_nodes" without reading the monitor files, so every index node of a host is treated as live.
+# durations is {("host", "node"): seconds}. The output is (planned, blocked). format: planned [PlannedJob] in start order, blocked [(RestartJob, reason)]
+def simulate_schedule(jobs, durations, parallel, group_limits, default_limit = None, start = 0, inventory = None):
+
+    live_nodes = {}
+    for job in jobs:
+        if job.host not in live_nodes:
+            live_nodes[job.host] = host_live_nodes(job.host, job.profile, remote = False, inventory = inventory)
+    guard = CapacityGuard(live_nodes, group_limits, default_limit)
+
+    planned = []
+    blocked = []
+    pending = []
+    for job in jobs:
+        reason = guard.blocked_reason(job)
+        if reason:
+            blocked.append((job, reason))
+        else:
+            pending.append(job)
+
+    running = []
+    sequence = itertools.count()
+    clock = start
+    while pending or running:
+
+        # Start every waiting job that fits, in selection order.
+        for job in list(pending):
+            if len(running) >= parallel:
+                break
+            if guard.can_start(job):
+                guard.start(job)
+                pending.remove(job)
+                end = clock + durations[(job.host, job.node)]
+                planned.append(PlannedJob(job, clock, end))
+                heapq.heappush(running, (end, next(sequence), job))
+
+        if pending and not running:
+            for job in pending:
+                blocked.append((job, "Not enough live nodes left on " + job.host + " to take it out of the F5 pool."))
+            break
+
+        # Jump to the next job that finishes.
+        if running:
+            clock, _, job = heapq.heappop(running)
+            guard.finish(job, True)
+
+    return planned, blocked
+
+
+# Function to plan the restart of the selected nodes: the wave schedule, the F5 drain set and the predicted wall time, and the lowest concurrency that fits plan_window. This runs no remote commands. With restart_mode "bluegreen" each side of a pair is one wave.
+# inventory is the Inventory the hosts are looked up in, the inventory of the job by default. The output is a RestartPlan, and the plan is added to the event stream, which renders it to console.
+def plan_restart(selected_restarts, parallel = None, group_limits = None, journal_path = None, inventory = None):
+
+    if parallel is None:
+        parallel = max_parallel_restarts
+    if group_limits is None:
+        group_limits = parse_group_limits(max_out_overrides)
+    group_limits = dict(group_limits)
+    group_limits.setdefault(elastic_function, 1)
+
+    action_results, jobs, profiles = restart_jobs(selected_restarts, "restart", inventory = inventory)
+    timings = journal_timings(journal_path, inventory)
+
+    # The predicted duration of each job, typical and pessimistic.
+    durations, durations_p95 = {}, {}
+    for job in jobs:
+        timing = timings.get(job.group[1])
+        durations[(job.host, job.node)] = timing.cycle_p50 if timing else plan_default_node_seconds
+        durations_p95[(job.host, job.node)] = timing.cycle_p95 if timing else plan_default_node_seconds
+
+    # The latency probes come first, then the canary on its own. Blue/green sides run one after the other, each as one wave. The rest is scheduled as a rolling restart afterwards.
+    def schedule(expected, parallel, default_limit = None):
+        sides, rolling_jobs = bluegreen_sides(jobs) if restart_mode == "bluegreen" else ([], list(jobs))
+        sides = [(side, live_side, list(side_jobs)) for side, live_side, side_jobs in sides]
+        planned = []
+        clock = plan_probe_seconds if jobs and (restart_order == "latency" or canary == "Yes") else 0
+
+        # The canary is picked by latency at run time. The middle web node of the candidates stands in for it.
+        if canary == "Yes":
+            candidates = sides[0][2] if sides else rolling_jobs
+            web_jobs = [job for job in candidates if job.group[1] != elastic_function]
+            if web_jobs:
+                canary_job = web_jobs[len(web_jobs) // 2]
+                candidates.remove(canary_job)
+                planned.append(PlannedJob(canary_job, clock, clock + expected[(canary_job.host, canary_job.node)]))
+                clock += expected[(canary_job.host, canary_job.node)]
+
+        for side, live_side, side_jobs in sides:
+            planned += [PlannedJob(job, clock, clock + expected[(job.host, job.node)]) for job in side_jobs]
+            clock += max(expected[(job.host, job.node)] for job in side_jobs)
+        rolling_planned, blocked = simulate_schedule(rolling_jobs, expected, parallel, group_limits, default_limit, clock, inventory)
+        return planned + rolling_planned, blocked
+
+    planned, blocked = schedule(durations, parallel)
+    planned_p95, _ = schedule(durations_p95, parallel)
+    predicted = max([item.end for item in planned] + [0])
+    predicted_p95 = max([item.end for item in planned_p95] + [0])
+
+    # The nodes taken out of the F5 pool, per group.
+    drain_set = {}
+    for item in planned:
+        if item.job.profile.split_env == "True" and item.job.group[1] in f5_functions:
+            drain_set.setdefault(item.job.group, []).append(item.job)
+
+    # The lowest concurrency that fits the window. The group cap is only raised if no parallelism fits under the current one.
+    recommendation = None
+    window = plan_window * 60
+    largest_group = max([len([job for job in jobs if job.group == group]) for group in set(job.group for job in jobs)] + [1])
+    for default_limit in range(max_out_per_group, largest_group + 1):
+        low, high = 1, max(1, len(jobs))
+        if max([item.end for item in schedule(durations, high, default_limit)[0]] + [0]) > window:
+            continue
+        while low < high:
+            middle = (low + high) // 2
+            if max([item.end for item in schedule(durations, middle, default_limit)[0]] + [0]) <= window:
+                high = middle
+            else:
+                low = middle + 1
+        recommendation = (low, default_limit)
+        break
+
+    # The waves are the jobs that start at the same time.
+    waves = []
+    for item in sorted(planned, key = lambda item: item.start):
+        if waves and waves[-1][0].start == item.start:
+            waves[-1].append(item)
+        else:
+            waves.append([item])
+
+    # To the event stream, and from there to console.
+    def clock_time(seconds):
+        return str(datetime.timedelta(seconds = int(round(seconds))))
+
+    emit("plan", nodes = len(jobs), hosts = len(profiles), restart_mode = restart_mode, max_parallel_restarts = parallel, max_out_per_group = max_out_per_group,
+         message = "\nRestart plan for " + str(len(jobs)) + " nodes on " + str(len(profiles)) + " hosts (" + restart_mode + ", max_parallel_restarts " + str(parallel) + ", max_out_per_group " + str(max_out_per_group) + "). No remote commands were run.")
+
+    emit("plan_section", message = "\nPast node timings (journal " + (journal_path or journal_file) + "):")
+    for function in sorted(set(job.group[1] for job in jobs), key = str):
+        timing = timings.get(function)
+        if timing:
+            emit("plan_timing", function = function, samples = timing.samples, restart_p50 = timing.restart_p50, readiness_p50 = timing.readiness_p50, cycle_p50 = timing.cycle_p50, cycle_p95 = timing.cycle_p95,
+                 message = "  " + str(function) + ": " + str(timing.samples) + " nodes, restart p50 " + str(round(timing.restart_p50 or 0)) + "s, readiness p50 " + str(round(timing.readiness_p50 or 0)) + "s, node cycle p50 " + str(round(timing.cycle_p50)) + "s, p95 " + str(round(timing.cycle_p95)) + "s")
+        else:
+            emit("plan_timing", function = function, samples = 0, cycle_p50 = plan_default_node_seconds, message = "  " + str(function) + ": no history, assuming " + str(round(plan_default_node_seconds)) + "s per node")
+
+    emit("plan_section", message = "\nF5 drain set:")
+    for group in drain_set:
+        limit = CapacityGuard({}, group_limits).limit(group)
+        emit("plan_drain", env = group[0], function = group[1], limit = limit, nodes = [[job.host, job.node] for job in drain_set[group]],
+             message = "  " + group[0] + " " + group[1] + " (at most " + str(limit) + " out at once): " + ", ".join(job.host + ":" + job.node for job in drain_set[group]))
+
+    emit("plan_section", message = "\nWaves:")
+    for number, wave in enumerate(waves, 1):
+        emit("plan_wave", wave = number, start = wave[0].start, nodes = [[item.job.host, item.job.node] for item in wave],
+             message = "  " + str(number) + ". at " + clock_time(wave[0].start) + ": " + ", ".join(item.job.host + ":" + item.job.node for item in wave))
+    for job, reason in blocked:
+        emit("plan_blocked", host = job.host, node = job.node, status = "failed", reason = reason, message = "  Blocked " + job.host + ": " + job.node + ". " + reason)
+
+    emit("plan_prediction", predicted = predicted, predicted_p95 = predicted_p95, message = "\nPredicted wall time: " + clock_time(predicted) + " (p95 " + clock_time(predicted_p95) + ")")
+    if recommendation:
+        emit("plan_recommendation", window = plan_window, max_parallel_restarts = recommendation[0], max_out_per_group = recommendation[1],
+             message = "Recommended for a " + "%g" % plan_window + " minute window: max_parallel_restarts=" + str(recommendation[0]) + " max_out_per_group=" + str(recommendation[1]))
+    else:
+        emit("plan_recommendation", window = plan_window, status = "failed", message = "The selection does not fit a " + "%g" % plan_window + " minute window at any concurrency.")
+
+    return RestartPlan(waves, drain_set, blocked, predicted, predicted_p95, recommendation)
@@ -0,0 +1,463 @@
+###########################################################################################
+# Module:      index_restart.remote
+# Description: Remote commands: the asyncio subprocess executor, pooled ssh connections,
+#              systemctl, the F5 monitor file flips and the batched host status.
+###########################################################################################
+
+
+import asyncio
+import atexit
+import os
+import shlex
+import shutil
+import subprocess
+import tempfile
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .events import emit
+from .tracing import describe_ssh, traced
+from .inventory import f5_function
+from .curl import sweep_workers
+
+
+# SSH settings. Every remote command shares one multiplexed connection (ControlMaster) per host for the whole run. An idle master closes itself after ssh_idle_timeout seconds.
+ssh_idle_timeout = int(os.getenv("ssh_idle_timeout", "300"))
+ssh_control_dir = None
+ssh_hosts = set()
+ssh_lock = threading.Lock()
+
+# Command executor settings. All remote commands run as asyncio subprocesses on one event loop: at most ssh_workers at once, ssh_per_host per host (kept below the sshd MaxSessions limit of a multiplexed connection), and each is killed after ssh_timeout seconds.
+ssh_workers = int(os.getenv("ssh_workers", "64"))
+ssh_per_host = int(os.getenv("ssh_per_host", "8"))
+ssh_timeout = float(os.getenv("ssh_timeout", "600"))
+executor_instance = None
+executor_lock = threading.Lock()
+
+# The line between the unit states and the monitor file states in the output of "host_status_command".
+status_marker = "--index-api-monitor--"
+
+# The outcome of setting a monitor file. format: node, prior state, new state ("true", "false", "missing" or "unknown"), whether the new state is the wanted one.
+F5Transition = namedtuple("F5Transition", ["node", "prior", "new", "ok"])
+
+
+# Function to build the ssh options for the pooled connections. The control sockets are kept in a temp directory owned by this run, which is removed by "ssh_pool_close".
+def ssh_options():
+    global ssh_control_dir
+
+    # Create the control socket directory on first use.
+    with ssh_lock:
+        if ssh_control_dir is None:
+            ssh_control_dir = tempfile.mkdtemp(prefix="ssh-mux-")
+            atexit.register(ssh_pool_close)
+        control_dir = ssh_control_dir
+
+    return ["-o", "ControlMaster=auto",
+            "-o", "ControlPath=" + os.path.join(control_dir, "%C"),
+            "-o", "ControlPersist=" + str(ssh_idle_timeout)]
+
+
+# Class to run remote commands as asyncio subprocesses, from argument lists (no local shell). It owns the event loop of the job, which runs on its own thread so the worker threads can hand it commands too.
+# Each command holds a global and a per host semaphore while it runs, and is killed on timeout or cancellation.
+class CommandExecutor:
+
+    def __init__(self, workers = None, per_host = None):
+        self.workers = workers or ssh_workers
+        self.per_host = per_host or ssh_per_host
+        self.loop = asyncio.new_event_loop()
+
+        # Blocking calls (the HTTP checks) run on a bounded thread pool of the loop.
+        self.loop.set_default_executor(ThreadPoolExecutor(max_workers = max(1, sweep_workers), thread_name_prefix = "command-executor-io"))
+        self.host_limits = {}
+        self.limit = None
+        self.thread = threading.Thread(target = self.loop.run_forever, name = "command-executor", daemon = True)
+        self.thread.start()
+
+    # The semaphores are created on the loop, the first time they are needed.
+    def host_limit(self, host):
+        if self.limit is None:
+            self.limit = asyncio.Semaphore(self.workers)
+        if host not in self.host_limits:
+            self.host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self.host_limits[host]
+
+    # Run a command for a host. This returns the completed process (returncode, stdout, stderr). A timeout is reported as returncode 255, same as an ssh failure.
+    async def run(self, host, command, timeout = None):
+
+        timeout = ssh_timeout if timeout is None else timeout
+        host_limit = self.host_limit(host)
+
+        async with self.limit:
+            async with host_limit:
+                process = await asyncio.create_subprocess_exec(*command, stdin = asyncio.subprocess.DEVNULL, stdout = asyncio.subprocess.PIPE, stderr = asyncio.subprocess.PIPE)
+                try:
+                    stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    await self.kill(process)
+                    return subprocess.CompletedProcess(command, 255, "", "The ssh command timed out after " + str(timeout) + " seconds.")
+                except asyncio.CancelledError:
+                    await self.kill(process)
+                    raise
+
+        return subprocess.CompletedProcess(command, process.returncode, stdout.decode(errors = "replace"), stderr.decode(errors = "replace"))
+
+    async def kill(self, process):
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+    # Run a coroutine on the executors loop from another thread, and wait for its result. If the waiting thread is interrupted, the coroutine is cancelled.
+    def run_sync(self, coroutine):
+
+        if threading.current_thread() is self.thread:
+            raise RuntimeError("run_sync can not be called from the executor loop. Await the coroutine instead.")
+
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            future.cancel()
+            raise
+
+
+# Function to get the command executor of the job, created on first use.
+def command_executor():
+    global executor_instance
+
+    with executor_lock:
+        if executor_instance is None:
+            executor_instance = CommandExecutor()
+        return executor_instance
+
+
+# Function to run a coroutine on the job's event loop and wait for its result. This is how the synchronous helpers and worker threads drive the async pipeline.
+def run_async(coroutine):
+
+    return command_executor().run_sync(coroutine)
+
+
+# Function to run a command on a remote host through the pooled ssh connection, on the job's event loop. The remote command is one string, interpreted by the remote shell. This returns the completed process (returncode, stdout, stderr). A timeout is reported as returncode 255, same as an ssh failure.
+@traced("ssh_run", describe = describe_ssh)
+async def async_ssh_run(host, remote_command, timeout = None):
+
+    # Assemble the ssh command. format: ssh -q -t -o ControlMaster=auto ... <fqdn> "<remote command>"
+    ssh_cmd = ["ssh", "-q", "-t"] + ssh_options() + [host, remote_command]
+
+    # Remember the host so its master connection is closed at the end of the run.
+    with ssh_lock:
+        ssh_hosts.add(host)
+
+    return await command_executor().run(host, ssh_cmd, timeout)
+
+
+# Function to run a command on a remote host and wait for it. See "async_ssh_run".
+def ssh_run(host, remote_command, timeout = None):
+
+    return run_async(async_ssh_run(host, remote_command, timeout))
+
+
+# Function to close every pooled ssh connection and remove the control socket directory. This is safe to call more than once.
+def ssh_pool_close():
+    global ssh_control_dir
+
+    with ssh_lock:
+        control_dir = ssh_control_dir
+        hosts = sorted(ssh_hosts)
+        ssh_control_dir = None
+        ssh_hosts.clear()
+
+    if control_dir is None:
+        return
+
+    # Ask each master connection to exit.
+    for host in hosts:
+        subprocess.run(["ssh", "-q", "-o", "ControlPath=" + os.path.join(control_dir, "%C"), "-O", "exit", host],
+                capture_output=True, text=True)
+
+    shutil.rmtree(control_dir, ignore_errors=True)
+
+
+# Function to build the remote systemctl command for a node. The full service file name is tried first, then the shortened name. format: sudo systemctl restart tomcat@node1.service || sudo systemctl restart tomcat@node1
+def systemctl_command(action, node, sudo = True):
+
+    shortened_node = re.search(r".+(?=\.service)", node)
+    short_name = shortened_node.group() if shortened_node else node
+    prefix = "sudo systemctl " if sudo else "systemctl "
+
+    return prefix + action + " " + shlex.quote(node) + " || " + prefix + action + " " + shlex.quote(short_name)
+
+
+# Function to build the path to a nodes monitor file, based on if the host is serving the index or data api. The node is the service file name, ex. "tomcat@node1.service". This returns None if the host serves neither.
+def monitor_file_path(node, function, monitor_file):
+
+    # Shorten the service file name to insert it into the monitor file path.
+    path_node = re.search(r"(?<=@)(.*)\.", node)
+    short_name = path_node.group(1) if path_node else node
+
+    if "data_access_layer" in function:
+        return "/data/tomcat/base.d/" + short_name + "/webapps/ROOT/" + monitor_file
+    elif "middle_tier_and_ui" in function:
+        return "/data/tomcat/base/" + short_name + "/webapps/ROOT/" + monitor_file
+
+    return None
+
+
+# Function to build the remote command that sets the monitor files of a hosts nodes in one call. For each file it checks the current state, flips it if needed and verifies it, while holding a lock on the files directory. entries is a list of monitor file paths, want is "true" or "false".
+# Each file prints one line. format: "F5 <position> <prior> <new>", where the states are "true", "false", "missing" or "locked". The command exits non-zero if any file did not end up in the wanted state.
+def f5_transition_command(entries, want):
+
+    flip = ("f5_set() { "
+            "if [ ! -w \"$2\" ]; then echo \"F5 $1 missing missing\"; return 1; fi; "
+            "( if command -v flock >/dev/null 2>&1; then flock -w 10 9 || { echo \"F5 $1 locked locked\"; exit 1; }; fi; "
+            "if grep -q true \"$2\"; then prior=true; else prior=false; fi; "
+            "[ \"$prior\" = \"$3\" ] || sed -i \"0,/$prior/s//$3/\" \"$2\"; "
+            "if grep -q true \"$2\"; then new=true; else new=false; fi; "
+            "echo \"F5 $1 $prior $new\"; "
+            "[ \"$new\" = \"$3\" ] ) 9<\"$(dirname \"$2\")\"; }; ")
+
+    calls = ["f5_set " + str(position) + " " + shlex.quote(path) + " " + want + " || rc=1" for position, path in enumerate(entries)]
+
+    return flip + "rc=0; " + "; ".join(calls) + "; exit $rc"
+
+
+# Function to parse the output of "f5_transition_command". The output is a dictionary of {"node": F5Transition}. A node without an output line (ex. the ssh command failed) is "unknown".
+def parse_f5_transitions(nodes, stdout, want):
+
+    transitions = {node: F5Transition(node, "unknown", "unknown", False) for node in nodes}
+
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) == 4 and fields[0] == "F5" and fields[1].isdigit() and int(fields[1]) < len(nodes):
+            node = nodes[int(fields[1])]
+            transitions[node] = F5Transition(node, fields[2], fields[3], fields[3] == want)
+
+    return transitions
+
+
+# Function to drain ("false") or insert ("true") all the given nodes of a host in one remote call. Run the "server_profile" function prior to this, to get the applicable input variable in the proper format. The output is a dictionary of {"node": F5Transition}.
+@traced("f5_node_set", describe = lambda values: (values.get("host"), ",".join(values.get("nodes", [])), "insert" if values.get("want") == "true" else "drain"))
+async def async_f5_node_set(host, nodes, want, function, monitor_file):
+
+    # Build the path to each monitor file.
+    paths = [monitor_file_path(node, function, monitor_file) for node in nodes]
+
+    # A node without a monitor file can not be changed.
+    transitions = {node: F5Transition(node, "missing", "missing", False) for node, path in zip(nodes, paths) if path is None}
+    remaining = [node for node, path in zip(nodes, paths) if path is not None]
+
+    if remaining:
+        set_cmd = await async_ssh_run(host, f5_transition_command([path for path in paths if path is not None], want))
+        transitions.update(parse_f5_transitions(remaining, set_cmd.stdout, want))
+
+    return {node: transitions[node] for node in nodes}
+
+
+# Function to drain or insert all the given nodes of a host in one remote call, and wait for it. See "async_f5_node_set".
+def f5_node_set(host, nodes, want, function, monitor_file):
+
+    return run_async(async_f5_node_set(host, nodes, want, function, monitor_file))
+
+
+# Function to remove all the given nodes of a host from the F5 load balancing pool in one remote call. The output is a dictionary of {"node": F5Transition}.
+def f5_drain_nodes(host, nodes, function, monitor_file):
+
+    return f5_node_set(host, nodes, "false", function, monitor_file)
+
+
+# Function to add all the given nodes of a host into the F5 load balancing pool in one remote call. The output is a dictionary of {"node": F5Transition}.
+def f5_insert_nodes(host, nodes, function, monitor_file):
+
+    return f5_node_set(host, nodes, "true", function, monitor_file)
+
+
+# Function to remove a node from the F5 load balancing pool. This checks, flips and verifies the monitor file in one remote call. The output is an F5Transition: name.prior and name.new ("true", "false", "missing" or "unknown") and name.ok.
+async def async_f5_node_drain(host, node, function, monitor_file):
+
+    transitions = await async_f5_node_set(host, [node], "false", function, monitor_file)
+
+    return transitions[node]
+
+
+# Function to remove a node from the F5 load balancing pool and wait for it. See "async_f5_node_drain".
+def f5_node_drain(host, node, function, monitor_file):
+
+    return run_async(async_f5_node_drain(host, node, function, monitor_file))
+
+
+# Function to add a node into the F5 load balancing pool. Run the "server_profile" function prior to this, to get the applicable input variable in the proper format. This checks, flips and verifies the monitor file in one remote call, and returns 0 if the node is in the pool afterwards, 1 if not.
+@traced("f5_node_insert")
+async def async_f5_node_insert(host, node, function, monitor_file):
+
+    transitions = await async_f5_node_set(host, [node], "true", function, monitor_file)
+
+    return 0 if transitions[node].ok else 1
+
+
+# Function to add a node into the F5 load balancing pool and wait for it. See "async_f5_node_insert".
+def f5_node_insert(host, node, function, monitor_file):
+
+    return run_async(async_f5_node_insert(host, node, function, monitor_file))
+
+
+# Function to check the status of a nodes monitor file. Run the "server_profile" function prior to this, to get the applicable input variable in the proper format. This will return true or false based on the ssh command exit code.
+@traced("f5_node_status")
+async def async_f5_node_status(host, node, function, monitor_file):
+   
+    # Build the path to the monitor file.
+    mon_file_path = monitor_file_path(node, function, monitor_file)
+
+
+    # Run the ssh command to check if the monitor file shows true.
+    f5_status_cmd = await async_ssh_run(host, "grep -q 'true' " + shlex.quote(mon_file_path))
+    
+    return f5_status_cmd.returncode
+
+
+# Function to check the status of a nodes monitor file and wait for it. See "async_f5_node_status".
+def f5_node_status(host, node, function, monitor_file):
+
+    return run_async(async_f5_node_status(host, node, function, monitor_file))
+
+
+# Function to start, stop, restart, or retrieve the status of a node on a remote host. on_drained is called once the node has been removed from the F5 pool, before the action runs. This returns the ssh command exit code, any possible eror messages, whether or not the node was removed from the F5 pool, or a service file status. Additionally, this adds a "drain" event if the node is being removed from the F5 pool in order to perform the action. Run the "server_profile" function prior to this, to get the applicable input variable in the proper format.
+@traced("node_action_command")
+async def async_node_action_command(host, node, action, split_env, monitor_file, function, on_drained = None):    
+     
+    # Define the functions minimal output.
+    action_cmd_result = bool
+    error = ""
+    f5_removal = False
+    status = ""
+    shortened_node = re.search(r".+(?=\.service)", node)
+    
+    # If the host is a web server in a split env and not just checking status.
+    if f5_function(function) and (split_env == "True") and (action != "status"):
+        
+        # Remove the node from the load balancing pool if it is live. This checks, flips and verifies the monitor file in one remote call.
+        drain = await async_f5_node_drain(host, node, function, monitor_file)
+        
+        # If the node was live and is now out of the pool.
+        if drain.ok and drain.prior == "true":
+           
+            # Update the f5 removal output.
+            f5_removal = True
+            
+            # Progress update.
+            emit("drain", host = host, node = node, status = "ok", prior = drain.prior, message = shortened_node.group() + " was removed from the F5 pool to perform the action.")
+
+            # Let the caller record the drain before the action starts.
+            if on_drained:
+                on_drained()
+
+        # If the node was successfully removed from the F5 pool or was never live to begin with.
+        if drain.ok:
+            
+            # Run the ssh action command.
+            action_cmd = await async_ssh_run(host, systemctl_command(action, node))
+
+            # If the action command failed
+            if action_cmd.returncode != 0:
+               
+               action_cmd_result = False
+               error = "The " + action + " command FAILED. check the node."
+            
+            else:
+               
+               # Success.
+               action_cmd_result = True
+            
+        else:
+           
+           # The F5 removal command failed. The action is not performed.
+           action_cmd_result = False
+           error = "The command to remove " + host + ": " + node + " from the F5 pool FAILED (monitor file state: " + drain.prior + "). The " + action + " command will not be performed."
+
+    # If the action command is not status.     
+    elif action != "status":
+        
+        # Run the action command. 
+        # format: ssh -q -t <fqdn> "sudo systemctl restart tomcat@node1.service || sudo systemctl restart tomcat@node1"
+        action_cmd = await async_ssh_run(host, systemctl_command(action, node))
+        
+        # If the action command was successful.
+        if action_cmd.returncode == 0:
+           # Success
+           action_cmd_result = True
+        else:
+           # Fail
+           action_cmd_result = False
+           error = "The " + action + " command failed. Check the node."
+           
+    # If the function is checking status.
+    elif action == "status":
+
+       # If the service file is active.
+        action_cmd = await async_ssh_run(host, systemctl_command("is-active", node, sudo = False))
+
+        if action_cmd.returncode == 0:
+           status = "Active"
+        else:
+           status = "Inactive"
+
+
+    # Set the action command results as callable variables.   
+    output = namedtuple("output", ["action_cmd_result", "error", "f5_removal", "status"])
+
+    return output(action_cmd_result, error, f5_removal, status)
+
+
+# Function to start, stop, restart, or retrieve the status of a node on a remote host, and wait for it. See "async_node_action_command".
+def node_action_command(host, node, action, split_env, monitor_file, function, on_drained = None):
+
+    return run_async(async_node_action_command(host, node, action, split_env, monitor_file, function, on_drained))
+
+
+# Function to build the remote command that reports the state of a hosts nodes in one call: a single systemctl is-active for all the units, then the state of each monitor file (live, drained or missing). mon_file_paths has one entry per node, None if the node has no monitor file.
+def host_status_command(nodes, mon_file_paths):
+
+    checks = []
+    for path in mon_file_paths:
+        if path is None:
+            checks.append("echo n/a")
+        else:
+            quoted = shlex.quote(path)
+            checks.append("if [ ! -r " + quoted + " ]; then echo missing; elif grep -q 'true' " + quoted + "; then echo live; else echo drained; fi")
+
+    return "systemctl is-active " + " ".join(shlex.quote(node) for node in nodes) + "; echo " + status_marker + "; " + "; ".join(checks)
+
+
+# Function to parse the output of "host_status_command". The output is a dictionary of {"node": ["unit state", "f5 state"]}. Anything missing from the output is "unknown".
+def parse_host_status(nodes, stdout):
+
+    lines = [line.strip() for line in stdout.splitlines() if line.strip()]
+    unit_states, f5_states = [], []
+
+    if status_marker in lines:
+        split = lines.index(status_marker)
+        unit_states, f5_states = lines[:split], lines[split + 1:]
+
+    states = {}
+    for position, node in enumerate(nodes):
+        unit_state = unit_states[position] if position < len(unit_states) else "unknown"
+        f5_state = f5_states[position] if position < len(f5_states) else "unknown"
+        states[node] = [unit_state, f5_state]
+
+    return states
+
+
+# Function to read the unit and monitor file state of all the selected nodes on a host with one remote call. The output is the same as "parse_host_status".
+async def async_host_status(host, nodes, profile):
+
+    function = f5_function(profile.function)
+    paths = [monitor_file_path(node, [function], profile.monitor_file) if function else None for node in nodes]
+    status_cmd = await async_ssh_run(host, host_status_command(nodes, paths))
+
+    return parse_host_status(nodes, status_cmd.stdout)
+
+
+# Function to read the state of a hosts nodes and wait for it. See "async_host_status".
+def host_status(host, nodes, profile):
+
+    return run_async(async_host_status(host, nodes, profile))
@@ -0,0 +1,822 @@
+###########################################################################################
+# Module:      index_restart.restart
+# Description: The restart pipeline: capacity guard, latency ordering and canary, single
+#              node restarts, the rolling restart scheduler, elasticsearch restarts and the
+#              blue/green mode.
+###########################################################################################
+
+
+import asyncio
+import os
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .tracing import percentile, traced
+from .events import emit
+from .inventory import elastic_function, f5_function, f5_functions, job_function, server_profile, use_inventory
+from .curl import async_curl_get, async_wait_until_ready, curl_loop, readiness_uri, sweep_workers, warm_up_node, warmup
+from .remote import async_f5_node_set, async_ssh_run, f5_node_insert, host_status, node_action_command, run_async, ssh_run, systemctl_command
+from .discovery import discovered_nodes, node_port
+from .elastic import elastic_api, elastic_deadline, elastic_nodes, elastic_wait
+from .journal import journal_close, journal_load, journal_record, resume
+from .status import async_fleet_snapshot
+
+
+# Rolling restart settings. max_parallel_restarts caps the nodes being worked on at once. max_out_per_group caps the nodes out of the F5 pool at once for each (env, function) group.
+# max_out_overrides sets the cap for specific groups. format: "data_access_layer=2,prod_a:middle_tier_and_ui=3"
+max_parallel_restarts = int(os.getenv("max_parallel_restarts", "4"))
+max_out_per_group = int(os.getenv("max_out_per_group", "1"))
+max_out_overrides = os.getenv("max_out_overrides", "")
+
+# Blue/green settings. With restart_mode "bluegreen" the selected web nodes of paired envs are restarted one side at a time: the whole side is drained from the F5 pool, restarted in parallel, verified, warmed up and put back, then the other side follows.
+# A side is only drained while at least bluegreen_min_live (fraction) of the other sides web nodes are live and healthy. Nodes outside the pairs go through the rolling restart. env_pairs format: "prod_a:prod_b,fr_a:fr_b"
+restart_mode = os.getenv("restart_mode", "rolling")
+env_pairs = os.getenv("env_pairs", "prod_a:prod_b,fr_a:fr_b,er_a:er_b")
+bluegreen_min_live = float(os.getenv("bluegreen_min_live", "0.9"))
+
+# Ordering settings. Before the restarts start, every selected web node gets probe_samples curls of its readiness_uri. With restart_order "latency" the unhealthy nodes go first, then the slowest. Set it to "selection" to keep the Jenkins selection order.
+# With canary "Yes" the node with the median latency is restarted on its own first, and the rest of the run only goes ahead if its latency once it is back up beats its baseline (probed on its own right before the restart). Both are the median of canary_samples curls.
+# The canary may be slower than its baseline by canary_tolerance (fraction) or canary_min_delta (seconds), whichever is larger, so noise on a fast node does not stop the run.
+restart_order = os.getenv("restart_order", "latency")
+canary = os.getenv("canary", "Yes")
+canary_tolerance = float(os.getenv("canary_tolerance", "0.1"))
+canary_min_delta = float(os.getenv("canary_min_delta", "0.05"))
+canary_samples = int(os.getenv("canary_samples", "10"))
+probe_samples = int(os.getenv("probe_samples", "3"))
+
+# The response time of a node. healthy is whether every sample returned 200, latency is the median of the good samples in seconds (None if there were none).
+NodeProbe = namedtuple("NodeProbe", ["healthy", "latency", "errors"])
+
+# A single node to work on. format: host, node, group ("env", "function"), profile (see "server_profile"), resume (the nodes JournalEntry from an earlier attempt of the run, or None)
+RestartJob = namedtuple("RestartJob", ["host", "node", "group", "profile", "resume"])
+# The outcome of a single node. back_live is whether the node is serving traffic again afterwards.
+NodeResult = namedtuple("NodeResult", ["host", "node", "success", "f5_removal", "reinserted", "back_live", "error"])
+
+
+# Function to parse the max_out_overrides setting into a dictionary. format: {"data_access_layer": 2, "prod_a:middle_tier_and_ui": 3}
+def parse_group_limits(overrides):
+
+    group_limits = {}
+    for item in overrides.split(","):
+        if "=" in item:
+            key, value = item.split("=", 1)
+            group_limits[key.strip()] = int(value)
+
+    return group_limits
+
+
+# Class to guard the F5 pool capacity during a rolling restart. It keeps track of the live nodes on each host and the nodes that are out of the pool, per (env, function) group.
+# A node that is live counts against its groups limit while it is being worked on, and a hosts last live node is never taken out.
+class CapacityGuard:
+
+    def __init__(self, live_nodes, group_limits = None, default_limit = None):
+        self.live_nodes = {host: set(nodes) for host, nodes in live_nodes.items()}
+        self.group_limits = group_limits or {}
+        self.default_limit = max_out_per_group if default_limit is None else default_limit
+        self.group_out = {}
+        self.host_out = {}
+
+    # The cap for a group. "env:function" overrides "function", which overrides the default.
+    def limit(self, group):
+        env, function = group
+        key = str(env) + ":" + str(function)
+        if key in self.group_limits:
+            return self.group_limits[key]
+        return self.group_limits.get(function, self.default_limit)
+
+    # Whether the job takes a live tomcat node out of the pool.
+    def takes_out_live(self, job):
+        return job.node in self.live_nodes.get(job.host, ())
+
+    # Whether the job counts against its groups limit. Live tomcat nodes and elasticsearch nodes do.
+    def takes_out(self, job):
+        return self.takes_out_live(job) or job.group[1] == elastic_function
+
+    # The reason a job can never start, or "" if it can.
+    def blocked_reason(self, job):
+        if self.takes_out_live(job) and len(self.live_nodes[job.host]) <= 1:
+            return "It is the last live node on " + job.host + "."
+        return ""
+
+    # Whether the job can start right now.
+    def can_start(self, job):
+        if not self.takes_out(job):
+            return True
+        if self.group_out.get(job.group, 0) >= self.limit(job.group):
+            return False
+        if not self.takes_out_live(job):
+            return True
+        remaining = self.live_nodes[job.host] - self.host_out.get(job.host, set())
+        return len(remaining) > 1
+
+    def start(self, job):
+        if self.takes_out(job):
+            self.group_out[job.group] = self.group_out.get(job.group, 0) + 1
+            self.host_out.setdefault(job.host, set()).add(job.node)
+
+    # Release the jobs capacity. A node that did not come back is no longer counted as live.
+    def finish(self, job, back_live):
+        if job.node in self.host_out.get(job.host, ()):
+            self.group_out[job.group] -= 1
+            self.host_out[job.host].discard(job.node)
+            if not back_live:
+                self.live_nodes.get(job.host, set()).discard(job.node)
+
+
+# Function to list the index nodes of a host in an env. The running tomcat units discovered on the host (see "discover_nodes") take the place of the inventory ones, the inventory (the given Inventory, or the inventory of the job) is used for hosts without a fresh discovery. The output is a list of node names.
+def host_index_nodes(host, env, inventory = None):
+
+    nodes = list(use_inventory(inventory)["environments"][env]["services"]["index"])
+    units = discovered_nodes(host)
+
+    if units:
+        nodes = [node for node in nodes if not node.startswith("tomcat@")] + [unit for unit, ports in units.items() if ports]
+
+    return nodes
+
+
+# Function to find the live nodes on a host before the restarts start. In split envs a web node is live if its monitor file shows true, otherwise every index node of the host is treated as live. With remote False the monitor files are not read, and every index node is treated as live. The output is a set of node names.
+def host_live_nodes(host, profile, remote = True, inventory = None):
+
+    nodes = host_index_nodes(host, profile.env, inventory)
+    function = f5_function(profile.function)
+
+    if remote and profile.split_env == "True" and function:
+        states = host_status(host, nodes, profile)
+        return set(node for node in nodes if states[node][1] == "live")
+
+    return set(nodes)
+
+
+# Function to restart an elasticsearch node without a full shard reallocation: wait for green, limit allocation to primaries, flush, restart the unit, wait for the node to rejoin, re-enable allocation and wait for green again.
+# Allocation is always re-enabled, even if the restart fails. The progress is journaled under run_key like "restart_node". The output is a NodeResult.
+@traced("elastic_restart_node", describe = lambda values: (values["job"].host, values["job"].node, values.get("action")))
+def elastic_restart_node(job, action, run_key = None, inventory = None):
+
+    host, node = job.host, job.node
+    resume_state = job.resume.state if job.resume else None
+    deadline = time.monotonic() + elastic_deadline
+    error = ""
+
+    def record(state):
+        if run_key:
+            journal_record(run_key, host, node, state)
+
+    def is_green(response):
+        return response.status_code == 200 and isinstance(response.body, dict) and response.body.get("status") == "green"
+
+    record("started")
+    emit("node_started", host = host, node = node, action = action, message = "Performing the elasticsearch " + action + " command on " + node)
+
+    # Only start from a green cluster, and remember its size. The API is called on the port of the unit (see "elastic_nodes").
+    port = elastic_nodes(host, inventory).get(node)
+    health, green = elastic_wait(host, port, "/_cluster/health", is_green, deadline) if port else (None, False)
+    restarted = resume_state in ["restarted", "healthy"]
+
+    if not port:
+        error = node + " is not an elasticsearch unit of " + host + " in the inventory. The " + action + " command will not be performed."
+    elif not green and not restarted:
+        error = "The cluster is not green before the " + action + " (" + str(health.body.get("status") if isinstance(health.body, dict) else health.status_code) + "). The " + action + " command will not be performed."
+    else:
+        node_count = health.body.get("number_of_nodes", 0) if isinstance(health.body, dict) else 0
+
+        try:
+            if not restarted:
+
+                # Stop the cluster from moving replicas while the node is down, and flush so recovery is quick.
+                allocation = elastic_api(host, port, "/_cluster/settings", "PUT", {"persistent": {"cluster.routing.allocation.enable": "primaries"}})
+                if allocation.status_code != 200:
+                    raise RuntimeError("Limiting shard allocation to primaries FAILED (" + str(allocation.status_code) + ").")
+                elastic_api(host, port, "/_flush", "POST")
+                emit("drain", host = host, node = node, status = "ok", message = "Shard allocation is limited to primaries and the node is flushed.")
+
+                # Restart the unit.
+                action_cmd = ssh_run(host, systemctl_command(action, node))
+                if action_cmd.returncode != 0:
+                    raise RuntimeError("The " + action + " command FAILED. Check the node.")
+                record("restarted")
+                emit("restart", host = host, node = node, action = action, status = "ok", message = "The " + action + " command was successful.")
+
+                # Wait for the node to rejoin the cluster.
+                rejoin, rejoined = elastic_wait(host, port, "/_cluster/health", lambda response: response.status_code == 200 and isinstance(response.body, dict) and response.body.get("number_of_nodes", 0) >= node_count, deadline)
+                if not rejoined:
+                    raise RuntimeError("The node did not rejoin the cluster before the deadline.")
+                emit("readiness", host = host, node = node, status = "ok", message = "The node rejoined the cluster.")
+
+        except RuntimeError as exc:
+            error = str(exc)
+
+        finally:
+            # Always hand the shards back to the cluster.
+            allocation = elastic_api(host, port, "/_cluster/settings", "PUT", {"persistent": {"cluster.routing.allocation.enable": None}})
+            if allocation.status_code != 200:
+                error = (error + " " if error else "") + "Re-enabling shard allocation FAILED (" + str(allocation.status_code) + "). Check the cluster settings."
+            else:
+                emit("reinsert", host = host, node = node, status = "ok", message = "Shard allocation is re-enabled.")
+
+        # Gate the next node on a green cluster.
+        if not error:
+            health, green = elastic_wait(host, port, "/_cluster/health", is_green, deadline)
+            if green:
+                record("healthy")
+                record("done")
+                emit("readiness", host = host, node = node, status = "ok", message = "The cluster is green.")
+            else:
+                error = "The cluster did not turn green before the deadline (" + str(health.body.get("status") if isinstance(health.body, dict) else health.status_code) + ")."
+
+    success = not error
+    if error:
+        record("failed")
+    emit("node_done", host = host, node = node, action = action, status = "ok" if success else "failed", message = error or None, back_live = success)
+
+    return NodeResult(host, node, success, False, False, success, error)
+
+
+# Function to measure the response time of a node, on the job's event loop. The samples are sent one after the other so they do not slow each other down. This returns a NodeProbe.
+async def async_probe_node(host, port, samples = None):
+
+    latencies = []
+    errors = 0
+    for _ in range(max(1, probe_samples if samples is None else samples)):
+        response = await async_curl_get("https://" + host + ":" + str(port) + readiness_uri, status_only = True)
+        if response.status_code == 200:
+            latencies.append(response.elapsed.total_seconds())
+        else:
+            errors += 1
+
+    latencies.sort()
+    probe = NodeProbe(errors == 0, round(percentile(latencies, 0.5), 3) if latencies else None, errors)
+    emit("probe", host = host, port = port, status = "ok" if probe.healthy else "failed", latency = probe.latency, errors = errors)
+
+    return probe
+
+
+# Function to probe the response time of the web nodes of the restart jobs, all at once. Elasticsearch nodes and nodes without a port (in the given Inventory, or the inventory of the job) are not probed. The output is a dictionary of {("host", "node"): NodeProbe}.
+def probe_nodes(jobs, inventory = None):
+
+    targets = []
+    for job in jobs:
+        port = node_port(job.host, job.profile.env, job.node, inventory) if job.group[1] != elastic_function else None
+        if port:
+            targets.append(((job.host, job.node), port))
+
+    async def probe_all():
+        return await asyncio.gather(*[async_probe_node(key[0], port) for key, port in targets])
+
+    return dict(zip([key for key, port in targets], run_async(probe_all()))) if targets else {}
+
+
+# Function to format the latency of a NodeProbe for the console. ex. "0.25s" or "no response"
+def latency_text(latency):
+
+    return str(latency) + "s" if latency is not None else "no response"
+
+
+# Function to order the restart jobs by their probes: unhealthy nodes first, then the slowest. Nodes without a probe keep their order after them. The order is added to the event stream. The output is the ordered list of jobs.
+def order_jobs(jobs, probes):
+
+    def rank(job):
+        probe = probes[(job.host, job.node)]
+        return (probe.healthy, -(probe.latency or 0))
+
+    probed = sorted([job for job in jobs if (job.host, job.node) in probes], key = rank)
+    ordered = probed + [job for job in jobs if (job.host, job.node) not in probes]
+
+    emit("restart_order", order = [[job.host, job.node] for job in ordered], message = "\nRestart order, unhealthy and slowest first:")
+    for job in probed:
+        probe = probes[(job.host, job.node)]
+        emit("probe_rank", host = job.host, node = job.node, status = "ok" if probe.healthy else "failed", latency = probe.latency, errors = probe.errors,
+             message = job.host + ": " + job.node + " " + latency_text(probe.latency) + (", " + str(probe.errors) + " of " + str(probe_samples) + " curls failed" if probe.errors else ""))
+
+    return ordered
+
+
+# Function to pick the canary of a run: the healthy probed node with the median latency, so it represents the rest. This returns a RestartJob, or None if no node qualifies.
+def pick_canary(jobs, probes):
+
+    candidates = sorted([job for job in jobs if (job.host, job.node) in probes and probes[(job.host, job.node)].healthy], key = lambda job: probes[(job.host, job.node)].latency)
+
+    return candidates[len(candidates) // 2] if candidates else None
+
+
+# Function to restart the canary on its own (see "restart_node") and compare its response time to its baseline. The baseline is probed right before the restart, with the canary on its own like the probe afterwards, so both are measured the same way.
+# The probe afterwards only runs once the canary responds as expected (see "async_wait_until_ready"), also when check_nodes is "No". The output is (NodeResult, ok, reason), the reason is empty if the run can go ahead.
+def run_canary(job, action, check_nodes, run_key = None, inventory = None):
+
+    port = node_port(job.host, job.profile.env, job.node, inventory)
+    baseline = run_async(async_probe_node(job.host, port, canary_samples))
+    emit("canary", host = job.host, node = job.node, baseline = baseline.latency, message = "\nCanary: " + job.host + ": " + job.node + " (baseline " + latency_text(baseline.latency) + ")")
+    result = restart_node(job, action, check_nodes, run_key, inventory)
+
+    if not result.success:
+        reason = "The canary " + job.host + ": " + job.node + " failed the " + action + ". The run was stopped."
+        emit("canary_result", host = job.host, node = job.node, status = "failed", baseline = baseline.latency, message = reason)
+        return result, False, reason
+
+    # Give the canary time to come back up before measuring it. With check_nodes "Yes", "restart_node" already waited.
+    ready = check_nodes == "Yes" or run_async(async_wait_until_ready([(job.host, port, readiness_uri)]))[(job.host, port, readiness_uri)].success
+    probe = run_async(async_probe_node(job.host, port, canary_samples)) if ready else NodeProbe(False, None, 0)
+
+    # Without a baseline latency, the canary only has to respond.
+    if not probe.healthy or (baseline.latency is not None and probe.latency > baseline.latency + max(baseline.latency * canary_tolerance, canary_min_delta)):
+        reason = "The canary " + job.host + ": " + job.node + " responds in " + latency_text(probe.latency) + " after the " + action + ", not better than its baseline of " + latency_text(baseline.latency) + ". The run was stopped."
+        emit("canary_result", host = job.host, node = job.node, status = "failed", baseline = baseline.latency, latency = probe.latency, message = reason)
+        return result, False, reason
+
+    emit("canary_result", host = job.host, node = job.node, status = "ok", baseline = baseline.latency, latency = probe.latency,
+         message = "The canary responds in " + latency_text(probe.latency) + " after the " + action + " (baseline " + latency_text(baseline.latency) + "). The run goes ahead.")
+    return result, True, ""
+
+
+# Function to perform the action on a single node: remove it from the F5 pool when applicable, run the action, check the node via curl when check_nodes is "Yes", and put it back into the pool. The console output for the node is printed as one block.
+# A node that was removed from the pool is warmed up first (see "warm_up_node"), and only put back once it is warm. A stopped node is not checked, warmed up or put back, it stays out of the pool.
+# Every step is recorded in the journal under run_key. When the job carries a resume entry, the steps that already completed are skipped, ex. a node that is "warm" is only put back into the pool. The output is a NodeResult.
+def restart_node(job, action, check_nodes, run_key = None, inventory = None):
+
+    # Elasticsearch nodes go through the shard-aware restart.
+    if job.group[1] == elastic_function:
+        return elastic_restart_node(job, action, run_key, inventory)
+
+    host, node, profile = job.host, job.node, job.profile
+    reinserted = False
+    curl_success = None
+    error = ""
+
+    # Pick up where an earlier attempt of the run left off.
+    resume_state = job.resume.state if job.resume else None
+    f5_removal = bool(job.resume and job.resume.f5_removal)
+
+    def record(state):
+        if run_key:
+            journal_record(run_key, host, node, state, f5_removal)
+
+    def drained():
+        nonlocal f5_removal
+        f5_removal = True
+        record("drained")
+
+    record("started")
+    emit("node_started", host = host, node = node, action = action, message = "Performing the " + action + " command on " + node)
+
+    # Run the action, unless an earlier attempt already did.
+    if resume_state in ["restarted", "healthy", "warm"]:
+        emit("restart", host = host, node = node, action = action, status = "ok", resumed = resume_state, message = "The " + action + " command already completed in an earlier attempt of this run (" + resume_state + ").")
+        action_ok = True
+    else:
+        # Call the action command function. This will remove the node from the F5 pool if applicable.
+        action_result = node_action_command(host, node, action, split_env = profile.split_env, monitor_file = profile.monitor_file, function = profile.function, on_drained = drained)
+        action_ok = action_result.action_cmd_result == True
+        error = action_result.error
+
+        if action_ok:
+            record("restarted")
+
+    # If the action command was successful.
+    if action_ok:
+        emit("restart", host = host, node = node, action = action, status = "ok", message = "The " + action + " command was successful.")
+
+        # If the check_nodes UI selection is "Yes". A stopped node has nothing to check.
+        if check_nodes == "Yes" and action != "stop" and resume_state not in ["healthy", "warm"]:
+            emit("readiness_started", host = host, node = node, message = "The node will now go through checks for the proper response via curl.")
+
+            # Determine the port for the current node.
+            port = node_port(host, profile.env, node, inventory)
+
+            # Loop through curls to check the service functionality.
+            curl_check = curl_loop(host, port, readiness_uri, expected_response = [200, 60, True], duration = 35)
+            curl_success = curl_check.success
+
+            if curl_success:
+                record("healthy")
+                emit("readiness", host = host, node = node, port = port, status = "ok", message = "The service is responding as intended.")
+            else:
+                error = "The curl checks FAILED after the " + action + "\n" + curl_check.reason
+                emit("readiness", host = host, node = node, port = port, status = "failed", message = error)
+
+        # Warm up a node that was removed from the F5 pool before customers reach it.
+        if f5_removal and curl_success != False and warmup == "Yes" and action != "stop" and resume_state != "warm":
+            port = node_port(host, profile.env, node, inventory)
+            warm_up = warm_up_node(host, port)
+
+            if warm_up.success:
+                record("warm")
+                emit("warm_up", host = host, node = node, port = port, status = "ok", rounds = len(warm_up.rounds), p50 = warm_up.rounds[-1].p50, p95 = warm_up.rounds[-1].p95, p99 = warm_up.rounds[-1].p99,
+                     message = "The node is warmed up. p50 " + str(warm_up.rounds[-1].p50) + "s, p95 " + str(warm_up.rounds[-1].p95) + "s, p99 " + str(warm_up.rounds[-1].p99) + "s after " + str(len(warm_up.rounds)) + " rounds.")
+            else:
+                curl_success = False
+                error = warm_up.reason + " It stays out of the F5 pool."
+                emit("warm_up", host = host, node = node, port = port, status = "failed", rounds = len(warm_up.rounds), message = error)
+
+        # If the node was removed from the F5 pool and passed curl checks (if any). A stopped node stays out.
+        if f5_removal and curl_success != False and action == "stop":
+            record("done")
+            emit("reinsert", host = host, node = node, status = "ok", message = "The node stays out of the F5 pool while it is stopped.")
+
+        elif f5_removal and curl_success != False:
+            emit("reinsert_started", host = host, node = node, message = "The node is being placed back into the F5 load balancing pool.")
+
+            # Put the node back into the F5 pool.
+            if f5_node_insert(host, node, profile.function, profile.monitor_file) != 0:
+                error = "The command to add the node back into the F5 pool FAILED. Check the monitor file status."
+                emit("reinsert", host = host, node = node, status = "failed", message = error)
+            else:
+                reinserted = True
+                record("reinserted")
+                emit("reinsert", host = host, node = node, status = "ok", message = "Adding the node back into the F5 pool was a success. Verify the node via Heartbeat.")
+
+        elif curl_success != False:
+            record("done")
+
+    # The action command failed.
+    else:
+        emit("restart", host = host, node = node, action = action, status = "failed", message = error)
+
+    success = action_ok and curl_success != False and (reinserted or not f5_removal or action == "stop")
+    if not success:
+        record("failed")
+
+    # Whether the node is serving traffic again.
+    if f5_removal:
+        back_live = reinserted
+    else:
+        back_live = action_ok and action != "stop" and curl_success != False
+
+    emit("node_done", host = host, node = node, action = action, status = "ok" if success else "failed", f5_removal = f5_removal, reinserted = reinserted, back_live = back_live)
+
+    return NodeResult(host, node, success, f5_removal, reinserted, back_live, error)
+
+
+# Function to build the restart jobs of the selected nodes, in selection order. The hosts are profiled against the given Inventory, or the inventory of the job. Hosts that can not be profiled fail up front, and with a run_key the nodes an earlier attempt of the run already finished are skipped.
+# The output is (action_results, jobs, profiles). format: action_results {"host": {"node": NodeResult}}, jobs [RestartJob], profiles {"host": server_profile}
+def restart_jobs(selected_restarts, action, run_key = None, inventory = None):
+
+    action_results = {}
+    jobs = []
+    profiles = {}
+
+    # The progress of earlier attempts of this run. format: {("host", "node"): JournalEntry}
+    journal = journal_load(run_key) if run_key and resume == "Yes" else {}
+
+    # Call "server_profile" to determine info about each server, and build the jobs in selection order.
+    for host in selected_restarts:
+        host_profile = server_profile(host, inventory)
+
+        # The profile is an error message if the host could not be found.
+        if isinstance(host_profile, str):
+            emit("host_error", host = host, status = "failed", message = host + ": " + host_profile)
+            for node in selected_restarts[host]:
+                action_results.setdefault(host, {})[node] = NodeResult(host, node, False, False, False, False, host_profile)
+            continue
+
+        profiles[host] = host_profile
+        for node in selected_restarts[host]:
+            entry = journal.get((host, node))
+
+            # Skip the nodes an earlier attempt already finished.
+            if entry and entry.state in ["reinserted", "done"]:
+                emit("skip", host = host, node = node, status = "ok", resumed = entry.state, message = host + ": " + node + " already completed the " + action + " in an earlier attempt of this run. Skipping.")
+                action_results.setdefault(host, {})[node] = NodeResult(host, node, True, entry.f5_removal, entry.state == "reinserted", True, "")
+                continue
+
+            jobs.append(RestartJob(host, node, (host_profile.env, job_function(node, host_profile.function)), host_profile, entry))
+
+
+    return action_results, jobs, profiles
+
+
+# Function to run the action on all selected nodes in parallel waves. At most max_parallel_restarts nodes are worked on at once, and the CapacityGuard limits how many live nodes are out of the F5 pool per (env, function) group.
+# A waiting node starts as soon as capacity frees up. The nodes are ordered by their response time (see restart_order), and with gate the run waits on a canary first (see canary).
+# With a run_key the progress is journaled, and nodes completed by an earlier attempt of the same run are skipped. The run is closed in the journal once every node succeeded, unless close_run is False. inventory is the Inventory the hosts are looked up in, the inventory of the job by default. The input is the selected_restarts dictionary. The output is a dictionary of results. format: {"host": {"node": NodeResult}}
+def rolling_restart(selected_restarts, action, check_nodes, parallel = None, group_limits = None, run_key = None, close_run = True, gate = True, inventory = None):
+
+    if parallel is None:
+        parallel = max_parallel_restarts
+    if group_limits is None:
+        group_limits = parse_group_limits(max_out_overrides)
+
+    # Elasticsearch nodes go one at a time per env, unless overridden.
+    group_limits = dict(group_limits)
+    group_limits.setdefault(elastic_function, 1)
+
+    action_results, jobs, profiles = restart_jobs(selected_restarts, action, run_key, inventory)
+
+    # Restart the unhealthiest and slowest nodes first.
+    probes = probe_nodes(jobs, inventory) if restart_order == "latency" or (gate and canary == "Yes" and action == "restart") else {}
+    if restart_order == "latency":
+        jobs = order_jobs(jobs, probes)
+
+    # Find the live nodes on every host, in parallel.
+    with ThreadPoolExecutor(max_workers = max(1, min(sweep_workers, len(profiles) or 1))) as pool:
+        live_futures = {host: pool.submit(host_live_nodes, host, profiles[host], True, inventory) for host in profiles}
+    guard = CapacityGuard({host: future.result() for host, future in live_futures.items()}, group_limits)
+
+    # Jobs that can never start are reported up front.
+    pending = []
+    for job in jobs:
+        reason = guard.blocked_reason(job)
+        if reason:
+            emit("skip", host = job.host, node = job.node, status = "failed", reason = reason, message = "Skipping " + job.host + ": " + job.node + ". " + reason)
+            action_results.setdefault(job.host, {})[job.node] = NodeResult(job.host, job.node, False, False, False, True, reason)
+        else:
+            pending.append(job)
+
+    # Restart the canary on its own first. If it does not beat its baseline, the other nodes are left alone.
+    canary_job = pick_canary(pending, probes) if gate and canary == "Yes" and action == "restart" else None
+    if canary_job:
+        pending.remove(canary_job)
+        guard.start(canary_job)
+        result, canary_ok, reason = run_canary(canary_job, action, check_nodes, run_key, inventory)
+        guard.finish(canary_job, result.back_live)
+        action_results.setdefault(canary_job.host, {})[canary_job.node] = result
+
+        if not canary_ok:
+            for job in pending:
+                action_results.setdefault(job.host, {})[job.node] = NodeResult(job.host, job.node, False, False, False, True, reason)
+            pending = []
+
+    condition = threading.Condition()
+    running = [0]
+
+    # Release the jobs capacity and wake up the scheduler.
+    def job_done(job, future):
+        try:
+            result = future.result()
+        except Exception as exc:
+            result = NodeResult(job.host, job.node, False, False, False, False, "The " + action + " raised an error: " + str(exc))
+            emit("node_done", host = job.host, node = job.node, action = action, status = "failed", message = job.host + ": " + job.node + " " + result.error)
+        with condition:
+            guard.finish(job, result.back_live)
+            action_results.setdefault(job.host, {})[job.node] = result
+            running[0] -= 1
+            condition.notify()
+
+    with ThreadPoolExecutor(max_workers = max(1, parallel)) as pool:
+        with condition:
+            while pending or running[0]:
+
+                # Start every waiting job that fits, in selection order.
+                for job in list(pending):
+                    if running[0] >= parallel:
+                        break
+                    if guard.can_start(job):
+                        guard.start(job)
+                        pending.remove(job)
+                        running[0] += 1
+                        pool.submit(restart_node, job, action, check_nodes, run_key, inventory).add_done_callback(lambda future, job=job: job_done(job, future))
+
+                # If nothing is running and nothing fits, the waiting jobs can never start.
+                if pending and not running[0]:
+                    for job in pending:
+                        reason = "Not enough live nodes left on " + job.host + " to take it out of the F5 pool."
+                        emit("skip", host = job.host, node = job.node, status = "failed", reason = reason, message = "Skipping " + job.host + ": " + job.node + ". " + reason)
+                        action_results.setdefault(job.host, {})[job.node] = NodeResult(job.host, job.node, False, False, False, True, reason)
+                    pending = []
+
+                if running[0]:
+                    condition.wait()
+
+    # Close the run in the journal once every node succeeded, so the next run starts fresh.
+    if run_key and close_run:
+        journal_close(run_key, action_results)
+
+    return action_results
+
+
+# Function to parse the env_pairs setting. The output is a list of ("side a", "side b") in the order the sides are restarted.
+def parse_env_pairs(pairs):
+
+    env_pair_list = []
+    for item in pairs.split(","):
+        if ":" in item:
+            side_a, side_b = item.split(":", 1)
+            env_pair_list.append((side_a.strip(), side_b.strip()))
+
+    return env_pair_list
+
+
+# Function to check that the live side of a pair can carry the traffic while the other side is drained. Every web node of the live side (for the given F5 functions) is checked at once: its unit, its monitor file and its service port. This returns (ok, message).
+def side_capacity(live_side, functions, inventory = None):
+
+    inventory = use_inventory(inventory)
+    selection = {}
+    for function in functions:
+        for host in inventory.index.env_function_hosts.get((live_side, function), []):
+            selection[host] = host_index_nodes(host, live_side, inventory)
+
+    profiles = {}
+    for host in selection:
+        host_profile = server_profile(host, inventory)
+        if not isinstance(host_profile, str):
+            profiles[host] = host_profile
+
+    total = sum(len(nodes) for nodes in selection.values())
+    healthy = 0
+    if profiles:
+        host_states, port_results = run_async(async_fleet_snapshot(selection, profiles, inventory))
+        for host in profiles:
+            for node in selection[host]:
+                unit, f5 = host_states[host][node]
+                port = port_results[(host, node)].status_code if (host, node) in port_results else 0
+                if unit == "active" and f5 == "live" and port == 200:
+                    healthy += 1
+
+    message = live_side + " has " + str(healthy) + " of " + str(total) + " web nodes live and healthy (" + ", ".join(sorted(functions)) + ")."
+    return total > 0 and healthy >= bluegreen_min_live * total, message
+
+
+# Function to run one side of a pair as a single wave: drain all of its nodes from the F5 pool (one remote call per host), restart them all at once, wait until they respond as expected, warm them up, and put the good ones back (one remote call per host).
+# A node that fails a step stays out of the pool. The steps are journaled under run_key like "restart_node", and nodes carrying a resume entry skip the steps that already completed. The output is a dictionary of {("host", "node"): NodeResult}.
+@traced("side_wave", describe = lambda values: (values.get("side"), str(len(values.get("jobs", []))) + " nodes", values.get("action")))
+async def async_side_wave(side, jobs, action, check_nodes, run_key = None, inventory = None):
+
+    # The progress of each node. step is the resume state, touched is whether the drain went through. format: {("host", "node"): {"f5_removal": bool, "step": "state", "error": "", "touched": bool}}
+    nodes = {}
+    for job in jobs:
+        resume_state = job.resume.state if job.resume else None
+        nodes[(job.host, job.node)] = {"f5_removal": bool(job.resume and job.resume.f5_removal), "step": resume_state, "error": "", "touched": False}
+
+    def record(job, state):
+        if run_key:
+            journal_record(run_key, job.host, job.node, state, nodes[(job.host, job.node)]["f5_removal"])
+
+    def fail(job, event, error):
+        nodes[(job.host, job.node)]["error"] = error
+        emit(event, host = job.host, node = job.node, side = side, status = "failed", message = error)
+
+    def by_host(wave):
+        hosts = {}
+        for job in wave:
+            hosts.setdefault(job.host, []).append(job)
+        return hosts
+
+    def port(job):
+        return node_port(job.host, job.profile.env, job.node, inventory)
+
+    for job in jobs:
+        record(job, "started")
+        emit("node_started", host = job.host, node = job.node, action = action, side = side, message = "Performing the " + action + " command on " + job.node + " with the rest of " + side)
+
+    # Drain the whole side. A node that was not live stays out of the pool, same as in "node_action_command".
+    hosts = by_host(jobs)
+    drains = await asyncio.gather(*[async_f5_node_set(host, [job.node for job in hosts[host]], "false", hosts[host][0].profile.function, hosts[host][0].profile.monitor_file) for host in hosts])
+    for host, transitions in zip(hosts, drains):
+        for job in hosts[host]:
+            drain = transitions[job.node]
+            if not drain.ok:
+                fail(job, "drain", "The command to remove " + job.host + ": " + job.node + " from the F5 pool FAILED (monitor file state: " + drain.prior + "). The " + action + " command will not be performed.")
+                continue
+            nodes[(job.host, job.node)]["touched"] = True
+            if drain.prior == "true":
+                nodes[(job.host, job.node)]["f5_removal"] = True
+                record(job, "drained")
+                emit("drain", host = job.host, node = job.node, side = side, status = "ok", prior = drain.prior, message = "The node was removed from the F5 pool to perform the action.")
+
+    # Restart every drained node at once, unless an earlier attempt already did.
+    wave = [job for job in jobs if not nodes[(job.host, job.node)]["error"]]
+    restarts = [job for job in wave if nodes[(job.host, job.node)]["step"] not in ["restarted", "healthy", "warm"]]
+    action_cmds = await asyncio.gather(*[async_ssh_run(job.host, systemctl_command(action, job.node)) for job in restarts])
+    for job, action_cmd in zip(restarts, action_cmds):
+        if action_cmd.returncode != 0:
+            fail(job, "restart", "The " + action + " command FAILED. Check the node.")
+        else:
+            record(job, "restarted")
+            emit("restart", host = job.host, node = job.node, action = action, side = side, status = "ok", message = "The " + action + " command was successful.")
+
+    # Wait on the whole side at once. A stopped side has nothing to check, warm up or put back, it stays out of the pool.
+    wave = [job for job in wave if not nodes[(job.host, job.node)]["error"]]
+    stopped = action == "stop"
+    if check_nodes == "Yes" and not stopped:
+        checks = [job for job in wave if nodes[(job.host, job.node)]["step"] not in ["healthy", "warm"]]
+        ready = await async_wait_until_ready([(job.host, port(job), readiness_uri) for job in checks])
+        for job in checks:
+            curl_check = ready[(job.host, port(job), readiness_uri)]
+            if curl_check.success:
+                record(job, "healthy")
+                emit("readiness", host = job.host, node = job.node, port = port(job), side = side, status = "ok", message = "The service is responding as intended.")
+            else:
+                fail(job, "readiness", "The curl checks FAILED after the " + action + "\n" + curl_check.reason)
+
+    # Warm up the drained nodes before customers reach them.
+    wave = [job for job in wave if not nodes[(job.host, job.node)]["error"]]
+    if warmup == "Yes" and not stopped:
+        loop = asyncio.get_running_loop()
+        warm_ups = [job for job in wave if nodes[(job.host, job.node)]["f5_removal"] and nodes[(job.host, job.node)]["step"] != "warm"]
+        results = await asyncio.gather(*[loop.run_in_executor(None, warm_up_node, job.host, port(job)) for job in warm_ups])
+        for job, warm_up in zip(warm_ups, results):
+            if warm_up.success:
+                record(job, "warm")
+                emit("warm_up", host = job.host, node = job.node, port = port(job), side = side, status = "ok", rounds = len(warm_up.rounds), p50 = warm_up.rounds[-1].p50, p95 = warm_up.rounds[-1].p95, p99 = warm_up.rounds[-1].p99,
+                     message = "The node is warmed up. p50 " + str(warm_up.rounds[-1].p50) + "s, p95 " + str(warm_up.rounds[-1].p95) + "s, p99 " + str(warm_up.rounds[-1].p99) + "s after " + str(len(warm_up.rounds)) + " rounds.")
+            else:
+                fail(job, "warm_up", warm_up.reason + " It stays out of the F5 pool.")
+
+    # Swap the traffic back to the side.
+    wave = [job for job in wave if not nodes[(job.host, job.node)]["error"]]
+    hosts = by_host([job for job in wave if nodes[(job.host, job.node)]["f5_removal"] and not stopped])
+    inserts = await asyncio.gather(*[async_f5_node_set(host, [job.node for job in hosts[host]], "true", hosts[host][0].profile.function, hosts[host][0].profile.monitor_file) for host in hosts])
+    for host, transitions in zip(hosts, inserts):
+        for job in hosts[host]:
+            if transitions[job.node].ok:
+                record(job, "reinserted")
+                emit("reinsert", host = job.host, node = job.node, side = side, status = "ok", message = "Adding the node back into the F5 pool was a success. Verify the node via Heartbeat.")
+            else:
+                fail(job, "reinsert", "The command to add the node back into the F5 pool FAILED. Check the monitor file status.")
+
+    # Build the results.
+    action_results = {}
+    for job in jobs:
+        state = nodes[(job.host, job.node)]
+        success = not state["error"]
+        reinserted = success and state["f5_removal"] and not stopped
+        if success and not reinserted:
+            record(job, "done")
+        elif not success:
+            record(job, "failed")
+        # A node the drain did not go through was left as it was.
+        back_live = (success and not stopped) or not state["touched"]
+        action_results[(job.host, job.node)] = NodeResult(job.host, job.node, success, state["f5_removal"], reinserted, back_live, state["error"])
+        emit("node_done", host = job.host, node = job.node, action = action, side = side, status = "ok" if success else "failed", f5_removal = state["f5_removal"], reinserted = reinserted, back_live = back_live)
+
+    return action_results
+
+
+# Function to sort restart jobs for a blue/green restart. The web nodes of the paired envs (see env_pairs) are grouped by side, everything else (other envs, non split envs, elasticsearch) is left for the rolling restart.
+# The output is (sides, rolling_jobs). format: sides [("side", "live side", [RestartJob])] in restart order, rolling_jobs [RestartJob]
+def bluegreen_sides(jobs):
+
+    partners = {}
+    side_order = []
+    for side_a, side_b in parse_env_pairs(env_pairs):
+        partners[side_a], partners[side_b] = side_b, side_a
+        side_order += [side_a, side_b]
+
+    side_jobs = {}
+    rolling_jobs = []
+    for job in jobs:
+        if job.profile.env in partners and job.profile.split_env == "True" and job.group[1] in f5_functions:
+            side_jobs.setdefault(job.profile.env, []).append(job)
+        else:
+            rolling_jobs.append(job)
+
+    sides = [(side, partners[side], side_jobs[side]) for side in side_order if side in side_jobs]
+
+    return sides, rolling_jobs
+
+
+# Function to run the action as a blue/green restart across the paired envs (see env_pairs). For each pair, one side is restarted as a single wave (see "async_side_wave") while the other side carries the traffic, then the sides swap.
+# A side is only drained if the other side passes "side_capacity", and with canary "Yes" one node of the first side is restarted on its own first (see "run_canary"). The selected nodes outside the pairs (other envs, non split envs, elasticsearch) go through "rolling_restart", against the same inventory. The output is the same as "rolling_restart".
+def bluegreen_restart(selected_restarts, action, check_nodes, run_key = None, inventory = None):
+
+    action_results, jobs, profiles = restart_jobs(selected_restarts, action, run_key, inventory)
+    sides, rolling_jobs = bluegreen_sides(jobs)
+
+    # Restart a canary from the first side on its own. If it does not beat its baseline, nothing else is touched.
+    if canary == "Yes" and sides:
+        probes = probe_nodes(sides[0][2], inventory)
+        canary_job = pick_canary(sides[0][2], probes)
+        if canary_job:
+            sides[0][2].remove(canary_job)
+            result, canary_ok, reason = run_canary(canary_job, action, check_nodes, run_key, inventory)
+            action_results.setdefault(canary_job.host, {})[canary_job.node] = result
+
+            if not canary_ok:
+                for job in [job for side in sides for job in side[2]] + rolling_jobs:
+                    action_results.setdefault(job.host, {})[job.node] = NodeResult(job.host, job.node, False, False, False, True, reason)
+                sides, rolling_jobs = [], []
+
+    rolling = {}
+    for job in rolling_jobs:
+        rolling.setdefault(job.host, []).append(job.node)
+
+    for side, live_side, side_jobs in sides:
+        if not side_jobs:
+            continue
+
+        # Make sure the other side can carry the load before draining this one.
+        capacity_ok, capacity = side_capacity(live_side, set(job.group[1] for job in side_jobs), inventory)
+        emit("side", side = side, live_side = live_side, nodes = len(side_jobs), message = "\n=========== " + side + " ===========")
+        emit("side_capacity", side = live_side, status = "ok" if capacity_ok else "failed", message = capacity)
+
+        if not capacity_ok:
+            reason = live_side + " can not carry the traffic of " + side + ". " + capacity
+            emit("skip", side = side, status = "failed", reason = reason, message = "Skipping the " + action + " of " + side + ". " + reason)
+            for job in side_jobs:
+                action_results.setdefault(job.host, {})[job.node] = NodeResult(job.host, job.node, False, False, False, True, reason)
+            continue
+
+        side_results = run_async(async_side_wave(side, side_jobs, action, check_nodes, run_key, inventory))
+        for (host, node), result in side_results.items():
+            action_results.setdefault(host, {})[node] = result
+
+    # The rest of the selection.
+    if rolling:
+        rolling_results = rolling_restart(rolling, action, check_nodes, run_key = run_key, close_run = False, gate = False, inventory = inventory)
+        for host in rolling_results:
+            action_results.setdefault(host, {}).update(rolling_results[host])
+
+    if run_key:
+        journal_close(run_key, action_results)
+
+    return action_results
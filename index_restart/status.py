@@ -0,0 +1,342 @@
+###########################################################################################
+# Module:      index_restart.status
+# Description: Health snapshots: the concurrent service port sweep and the fleet status
+#              matrix.
+###########################################################################################
+
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from .events import emit
+from .inventory import elastic_function, inventory_cache_dir, job_function, server_profile, use_inventory
+from .curl import async_curl_get, curl_get, readiness_uri, sweep_per_host, sweep_workers
+from .remote import async_host_status, run_async
+from .discovery import discovered_nodes, node_port
+from .elastic import elastic_nodes
+
+
+# Health sweep settings. "sweep_service_ports" keeps the last result of every endpoint (host, port and uri) in sweep_cache_dir. An endpoint that answered as expected is only curled again after about sweep_healthy_ttl seconds, a failing or unknown one on every sweep.
+# Endpoints that were not checked for sweep_cache_ttl seconds are forgotten. The "sweep" action covers the service types of sweep_services for each function of the env, curling sweep_uri on each port. A function that is not listed gets the "index" services.
+# sweep_services format: "data_access_layer=index,elastic_index_layer=index+elastic"
+sweep_healthy_ttl = float(os.getenv("sweep_healthy_ttl", "300"))
+sweep_cache_ttl = float(os.getenv("sweep_cache_ttl", "86400"))
+sweep_cache_dir = os.getenv("sweep_cache_dir", inventory_cache_dir)
+sweep_uri = os.getenv("sweep_uri", "")
+sweep_services = os.getenv("sweep_services", "")
+sweep_cache = {}
+sweep_lock = threading.Lock()
+
+# The outcome of an incremental sweep. failed_curls is the same as for "check_service_port". newly_failed and recovered are the changes since the previous sweep, in the same format. probed and cached count the endpoints that were curled and the ones taken from the cache.
+SweepResult = namedtuple("SweepResult", ["failed_curls", "newly_failed", "recovered", "probed", "cached"])
+
+# The state of a single node in the fleet status matrix. format: unit ("active", "inactive", ...), f5 ("live", "drained", "missing", "n/a"), port (http status code of the readiness uri, 0 if it did not answer)
+NodeStatus = namedtuple("NodeStatus", ["unit", "f5", "port"])
+
+
+# Function to decide whether a node in the fleet status matrix is healthy: its unit is active, it is in the F5 pool (or not behind one) and its port answers 200.
+def node_healthy(node_status):
+
+    return node_status.unit == "active" and node_status.f5 in ["live", "n/a"] and node_status.port == 200
+
+
+# Function to list the curls of a service port sweep, in inventory order: every port of the service type on the envs hosts of the given function. The hosts and ports come from the given Inventory, or the inventory of the job. The output is a list of [host, port, service, url, slot].
+def service_port_probes(env, server_function, service_type, uri = "", inventory = None):
+
+  inventory = use_inventory(inventory)
+
+  # Define a list to hold the probes, in inventory order. format: [host, port, service, url, slot]
+  probes = []
+  host_slots = {}
+  
+  # The services and their ports for the given env. see inventories.json
+  env_services = inventory["environments"][env]["services"][service_type]
+
+  # Loop through hosts for the given env that match the applicable function.
+  for host in inventory.index.env_function_hosts.get((env, server_function), []):
+    server_type = inventory.index.host_server_type.get(host)
+
+    # The tomcat nodes discovered on the host (see "discover_nodes") take the place of the inventory ones.
+    services = dict(env_services)
+    units = discovered_nodes(host) if service_type == "index" else None
+    if units:
+      services = {service: port for service, port in services.items() if not service.startswith("tomcat@")}
+      for unit in units:
+        if node_port(host, env, unit, inventory):
+          services[unit] = node_port(host, env, unit, inventory)
+
+    # Loop through ports for the applicable service(s).
+    for service in services:
+      port = services[service]
+      
+      # Big nasty if condition to accomidate Elastic single instance hosts.
+      if server_type == "vm" and server_function == "elastic_index_layer" and port != 9200:
+        continue
+      elif server_type == "bm" and server_function == "elastic_index_layer" and service == "elasticsearch.service":
+        continue
+
+      # Define the URL.
+      url = "https://" + host + ":" + str(port)
+      
+      if uri:
+        url += uri
+
+      # The slot is the probes position on its host. It is used to interleave the hosts when submitting.
+      slot = host_slots.get(host, 0)
+      host_slots[host] = slot + 1
+
+      probes.append([host, port, service, url, slot])
+
+  return probes
+
+
+# Function to send the curls of a sweep (see "service_port_probes") concurrently through a bounded thread pool, with a per host limit so a single host is never flooded. The output is a list of CurlResult, in the order of the probes.
+def curl_probes(probes, workers = None, per_host = None, timeout = None):
+
+  # Fall back to the job wide concurrency settings.
+  if workers is None:
+    workers = sweep_workers
+  if per_host is None:
+    per_host = sweep_per_host
+
+  # Each host gets its own semaphore to cap the number of curls it receives at once.
+  host_limits = {}
+  for probe in probes:
+    host_limits.setdefault(probe[0], threading.BoundedSemaphore(max(1, per_host)))
+
+  # Perform the curl cmd while holding the hosts semaphore.
+  def probe(host, url):
+    with host_limits[host]:
+      return curl_get(url, timeout = timeout, status_only = True)
+
+  # Submit the probes round robin across the hosts, so the workers are not all waiting on the same host.
+  submit_order = sorted(range(len(probes)), key=lambda index: probes[index][4])
+  results = {}
+
+  with ThreadPoolExecutor(max_workers = max(1, workers)) as pool:
+    for index in submit_order:
+      results[index] = pool.submit(probe, probes[index][0], probes[index][3])
+
+  return [results[index].result() for index in range(len(probes))]
+
+
+# Function to loop through curls to hosts/ports. The curls are sent concurrently (see "curl_probes"). The results are added to the event stream in inventory order, and the output is the failed_curls dictionary of results. Dictionary format: {"host": ["port1", "port2", "port3"]}.
+# inventory is the Inventory to sweep, the inventory of the job by default.
+def check_service_port(env, server_function, service_type, expected_response = 200, uri = "", workers = None, per_host = None, timeout = None, inventory = None):
+
+  # Define a dictionary to hold results
+  failed_curls = {}
+
+  probes = service_port_probes(env, server_function, service_type, uri, inventory)
+  curls = curl_probes(probes, workers, per_host, timeout)
+
+  # Loop through the probes in inventory order so the console output is deterministic.
+  for (host, port, service, url, slot), curl in zip(probes, curls):
+
+    # If the response is bad, emit/store the results.
+    if curl.status_code != expected_response:
+
+      # Add the bad port to the host in the failed_curls dictionary.
+      failed_curls.setdefault(host, []).append(str(port))
+      
+      # To the event stream.
+      emit("port_check", host = host, port = port, service = service, env = env, status = "failed", status_code = curl.status_code, elapsed = curl.elapsed.total_seconds(), message = host + ":" + str(port) + " " + service + " FAILED the curl check in " + env)
+    else:
+      # To the event stream.
+      emit("port_check", host = host, port = port, service = service, env = env, status = "ok", status_code = curl.status_code, elapsed = curl.elapsed.total_seconds(), message = host + ":" + str(port) + " " + service + " passed the curl check in " + env)
+
+  return failed_curls
+
+
+# Function to read the sweep cache file into memory. Entries older than sweep_cache_ttl are dropped. format: {"url": {"ok": bool, "status_code": n, "time": epoch checked, "since": epoch of the first result in this state, "due": epoch of the next curl}}
+def load_sweep_cache():
+
+    oldest = time.time() - sweep_cache_ttl
+
+    try:
+        with open(os.path.join(sweep_cache_dir, "sweep.json")) as cache_file:
+            cached = json.load(cache_file)
+    except (OSError, ValueError):
+        cached = {}
+
+    with sweep_lock:
+        for url, entry in cached.items():
+            if isinstance(entry, dict) and entry.get("time", 0) >= oldest and url not in sweep_cache:
+                sweep_cache[url] = entry
+
+
+# Function to write the in memory sweep cache to disk atomically. The file is read again first, so sweeps of other envs running at the same time keep their entries. A failure here only costs the next sweep extra curls.
+def save_sweep_cache():
+
+    cache_file = os.path.join(sweep_cache_dir, "sweep.json")
+    oldest = time.time() - sweep_cache_ttl
+
+    try:
+        with open(cache_file) as current_file:
+            cached = json.load(current_file)
+    except (OSError, ValueError):
+        cached = {}
+
+    with sweep_lock:
+        cached.update(sweep_cache)
+    cached = {url: entry for url, entry in cached.items() if isinstance(entry, dict) and entry.get("time", 0) >= oldest}
+
+    try:
+        os.makedirs(sweep_cache_dir, mode=0o700, exist_ok=True)
+        temp_file = cache_file + "." + str(os.getpid())
+        with open(temp_file, "w") as snapshot_file:
+            json.dump(cached, snapshot_file, separators=(",", ":"))
+        os.replace(temp_file, cache_file)
+    except OSError:
+        pass
+
+
+# Function to sweep the service ports like "check_service_port", but incrementally. Endpoints that answered as expected within sweep_healthy_ttl are taken from the sweep cache instead of being curled, failing and unknown ones are always curled.
+# Only the changes since the previous sweep are added to the event stream: newly failed and recovered endpoints, then a summary. The output is a SweepResult.
+# inventory is the Inventory to sweep, the inventory of the job by default.
+def sweep_service_ports(env, server_function, service_type, expected_response = 200, uri = "", workers = None, per_host = None, timeout = None, inventory = None):
+
+    probes = service_port_probes(env, server_function, service_type, uri, inventory)
+    load_sweep_cache()
+
+    # The results of the previous sweep. Only the endpoints that are due get curled.
+    now = time.time()
+    with sweep_lock:
+        previous = {probe[3]: sweep_cache.get(probe[3]) for probe in probes}
+    due = [probe for probe in probes if previous[probe[3]] is None or not previous[probe[3]].get("ok") or previous[probe[3]].get("due", 0) <= now]
+    curls = dict(zip([probe[3] for probe in due], curl_probes(due, workers, per_host, timeout)))
+
+    failed_curls = {}
+    newly_failed = {}
+    recovered = {}
+    for host, port, service, url, slot in probes:
+        entry = previous[url]
+
+        # Remember the result. A healthy endpoints next curl is spread over the last quarter of its TTL, so the endpoints of a large env do not all come due on the same sweep.
+        if url in curls:
+            curl = curls[url]
+            ok = curl.status_code == expected_response
+            checked = time.time()
+            since = entry["since"] if entry and entry.get("ok") == ok and "since" in entry else checked
+            with sweep_lock:
+                sweep_cache[url] = {"ok": ok, "status_code": curl.status_code, "time": checked, "since": since, "due": checked + (sweep_healthy_ttl * random.uniform(0.75, 1) if ok else 0)}
+        else:
+            ok = True
+
+        if not ok:
+            failed_curls.setdefault(host, []).append(str(port))
+
+        # Report the changes. An endpoint without history counts as newly failed if it fails.
+        if not ok and (entry is None or entry.get("ok")):
+            newly_failed.setdefault(host, []).append(str(port))
+            emit("port_check", host = host, port = port, service = service, env = env, status = "failed", change = "failed", status_code = curl.status_code, elapsed = curl.elapsed.total_seconds(), message = host + ":" + str(port) + " " + service + " FAILED the curl check in " + env)
+        elif ok and entry is not None and not entry.get("ok"):
+            recovered.setdefault(host, []).append(str(port))
+            down_seconds = round(time.time() - entry.get("since", entry.get("time", 0)))
+            emit("port_check", host = host, port = port, service = service, env = env, status = "ok", change = "recovered", status_code = curl.status_code, elapsed = curl.elapsed.total_seconds(), down_seconds = down_seconds,
+                 message = host + ":" + str(port) + " " + service + " recovered in " + env + " after " + str(down_seconds) + " seconds")
+
+    save_sweep_cache()
+
+    still_failing = sum(len(ports) for ports in failed_curls.values()) - sum(len(ports) for ports in newly_failed.values())
+    emit("sweep", env = env, function = server_function, service_type = service_type, status = "failed" if newly_failed else "ok", endpoints = len(probes), probed = len(curls), cached = len(probes) - len(curls),
+         newly_failed = newly_failed, recovered = recovered, still_failing = still_failing,
+         message = "Swept " + str(len(probes)) + " " + service_type + " ports of " + env + " " + server_function + " (" + str(len(curls)) + " curled, " + str(len(probes) - len(curls)) + " cached): "
+                   + str(sum(len(ports) for ports in newly_failed.values())) + " newly failed, " + str(sum(len(ports) for ports in recovered.values())) + " recovered, " + str(still_failing) + " still failing.")
+
+    return SweepResult(failed_curls, newly_failed, recovered, len(curls), len(probes) - len(curls))
+
+
+# Function to list what the "sweep" action covers in an env: each function with hosts in the env, with the service types that apply to it (see sweep_services). Service types the env does not have are left out. The output is a list of ("function", "service type").
+def sweep_targets(env, services = None, inventory = None):
+
+    inventory = use_inventory(inventory)
+
+    # The service types per function. format: {"function": ["service type"]}
+    function_services = {}
+    for item in (sweep_services if services is None else services).split(","):
+        if "=" in item:
+            function, service_types = item.split("=", 1)
+            function_services[function.strip()] = [service_type.strip() for service_type in service_types.split("+") if service_type.strip()]
+
+    env_services = inventory["environments"][env].get("services", {}) if env in inventory["environments"] else {}
+    functions = [function for environment, function in inventory.index.env_function_hosts if environment == env]
+
+    return [(function, service_type) for function in functions for service_type in function_services.get(function, ["index"]) if service_type in env_services]
+
+
+# Function to gather the remote state of each host and the port check of each node, all at once on the job's event loop. The ports come from the given Inventory, or the inventory of the job. The output is ({"host": states}, {(host, node): CurlResult}).
+async def async_fleet_snapshot(selected_restarts, profiles, inventory = None):
+
+    state_calls = {}
+    port_calls = {}
+    for host in profiles:
+        nodes = selected_restarts[host]
+        state_calls[host] = async_host_status(host, nodes, profiles[host])
+
+        for node in nodes:
+            port = node_port(host, profiles[host].env, node, inventory)
+            if port:
+                port_calls[(host, node)] = async_curl_get("https://" + host + ":" + str(port) + readiness_uri, status_only = True)
+            elif job_function(node, profiles[host].function) == elastic_function and elastic_nodes(host, inventory).get(node):
+                port_calls[(host, node)] = async_curl_get("https://" + host + ":" + str(elastic_nodes(host, inventory)[node]) + "/", status_only = True)
+
+    states = await asyncio.gather(*state_calls.values())
+    ports = await asyncio.gather(*port_calls.values())
+
+    return dict(zip(state_calls, states)), dict(zip(port_calls, ports))
+
+
+# Function to take a health snapshot of the selected nodes. Each host gets one remote call for all its nodes, and each nodes service port is curled, all in parallel. Each node is added to the event stream, and the host x node status matrix is rendered to console from it.
+# inventory is the Inventory the hosts are looked up in, the inventory of the job by default. The output is a dictionary of {"host": {"node": NodeStatus}}. Hosts that could not be profiled are left out.
+def fleet_status(selected_restarts, inventory = None):
+
+    profiles = {}
+    for host in selected_restarts:
+        host_profile = server_profile(host, inventory)
+        if isinstance(host_profile, str):
+            emit("host_error", host = host, status = "failed", message = host + ": " + host_profile)
+        else:
+            profiles[host] = host_profile
+
+    # Fan out the remote calls and the port checks together.
+    host_states, port_results = run_async(async_fleet_snapshot(selected_restarts, profiles, inventory))
+
+    status_matrix = {}
+    for host in profiles:
+        states = host_states[host]
+        status_matrix[host] = {}
+        for node in selected_restarts[host]:
+            port = port_results[(host, node)].status_code if (host, node) in port_results else 0
+            status_matrix[host][node] = NodeStatus(states[node][0], states[node][1], port)
+            emit("node_status", host = host, node = node, status = "ok" if node_healthy(status_matrix[host][node]) else "failed", unit = states[node][0], f5 = states[node][1], port_status = port)
+
+    # The matrix columns are the selected nodes, in order of first selection.
+    columns = []
+    for host in selected_restarts:
+        for node in selected_restarts[host]:
+            if node not in columns:
+                columns.append(node)
+
+    # To console. Each cell is unit/f5/port, and a row is red if any of its nodes is not healthy.
+    host_width = max([len(host) for host in status_matrix] + [4]) + 2
+    cell_width = max([len(node) for node in columns] + [24]) + 2
+    emit("status_header", columns = columns, message = "Host".ljust(host_width) + "".join(node.ljust(cell_width) for node in columns))
+
+    for host in status_matrix:
+        row = host.ljust(host_width)
+        for node in columns:
+            if node not in status_matrix[host]:
+                row += "-".ljust(cell_width)
+            else:
+                node_status = status_matrix[host][node]
+                row += (node_status.unit + "/" + node_status.f5 + "/" + str(node_status.port)).ljust(cell_width)
+        emit("status_row", host = host, status = "ok" if all(node_healthy(node_status) for node_status in status_matrix[host].values()) else "failed", message = row)
+
+    return status_matrix
@@ -0,0 +1,181 @@
+###########################################################################################
+# Module:      index_restart.tracing
+# Description: Per step timing of the restart job. Spans are recorded by the traced
+#              decorator and written as JSON and Prometheus textfile histograms.
+###########################################################################################
+
+
+import json
+import os
+import datetime
+import functools
+import inspect
+import time
+import threading
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+
+# Tracing settings. When trace_dir is set, a span is recorded for every traced step, and the per-run latency histograms are written to trace_dir at the end of the job. trace_buckets are the histogram bucket bounds in seconds.
+trace_dir = os.getenv("trace_dir", "")
+trace_run_id = os.getenv("BUILD_TAG") or datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+trace_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+trace_spans = []
+trace_lock = threading.Lock()
+
+# A single traced step. format: step name, host, node, action, start (epoch seconds), duration (seconds), whether it succeeded.
+TraceSpan = namedtuple("TraceSpan", ["step", "host", "node", "action", "start", "duration", "ok"])
+
+
+# Function to decide whether a traced step succeeded, based on what it returned.
+def span_ok(result):
+
+    if isinstance(result, bool):
+        return result
+    if isinstance(result, int):
+        return result == 0
+    for field in ["success", "action_cmd_result", "returncode"]:
+        if hasattr(result, field):
+            value = getattr(result, field)
+            return value == 0 if field == "returncode" else value == True
+    if hasattr(result, "status_code"):
+        return result.status_code != 0
+
+    return True
+
+
+# Decorator to record a span for each call of a step. describe turns the call arguments into (host, node, action); by default they are taken from the arguments of the same name.
+# When trace_dir is not set the call goes straight through, so tracing costs a single check.
+def traced(step, describe = None):
+
+    def decorator(func):
+        parameters = list(inspect.signature(func).parameters)
+
+        # Match the arguments to their names, and describe the call.
+        def describe_call(args, kwargs):
+            values = dict(zip(parameters, args))
+            values.update(kwargs)
+            if describe:
+                return describe(values)
+            return values.get("host"), values.get("node"), values.get("action")
+
+        def record(call, start, started, ok):
+            span = TraceSpan(step, call[0], call[1], call[2], start, time.perf_counter() - started, ok)
+            with trace_lock:
+                trace_spans.append(span)
+
+        # Coroutines are timed from the first await to the result.
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not trace_dir:
+                    return await func(*args, **kwargs)
+
+                call = describe_call(args, kwargs)
+                start, started, ok = time.time(), time.perf_counter(), False
+                try:
+                    result = await func(*args, **kwargs)
+                    ok = span_ok(result)
+                    return result
+                finally:
+                    record(call, start, started, ok)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not trace_dir:
+                return func(*args, **kwargs)
+
+            call = describe_call(args, kwargs)
+            start, started, ok = time.time(), time.perf_counter(), False
+            try:
+                result = func(*args, **kwargs)
+                ok = span_ok(result)
+                return result
+            finally:
+                record(call, start, started, ok)
+
+        return wrapper
+
+    return decorator
+
+
+# Function to describe a curl for its span. The node is the port, and the action is the HTTP method.
+def describe_curl(values):
+
+    url = urlsplit(values["url"])
+    return url.hostname, str(url.port or ""), values.get("method", "GET")
+
+
+# Function to describe an ssh command for its span. The action is the remote program, ignoring sudo.
+def describe_ssh(values):
+
+    words = [word for word in values.get("remote_command", "").split() if word != "sudo"]
+    return values.get("host"), None, words[0].rstrip("()") if words else ""
+
+
+# Function to pick a percentile from a sorted list of values, by nearest rank. fraction is 0 to 1, ex. 0.95 for p95.
+def percentile(sorted_values, fraction):
+
+    return sorted_values[int(fraction * (len(sorted_values) - 1))]
+
+
+# Function to write the per-run latency histograms of the recorded spans to trace_dir: a JSON report and a Prometheus textfile-collector file (index_api.prom). This does nothing when tracing is disabled.
+def write_trace_report(directory = None):
+
+    directory = directory or trace_dir
+    if not directory:
+        return
+
+    with trace_lock:
+        spans = list(trace_spans)
+
+    # Group the spans by step and action.
+    steps = {}
+    for span in spans:
+        steps.setdefault((span.step, span.action or ""), []).append(span)
+
+    report = {"run_id": trace_run_id, "buckets": trace_buckets, "steps": [], "spans": [span._asdict() for span in spans]}
+    prom_lines = ["# HELP index_api_step_duration_seconds Duration of each step of the index API job.",
+                  "# TYPE index_api_step_duration_seconds histogram"]
+    failure_lines = ["# HELP index_api_step_failures Failed steps of the index API job.",
+                     "# TYPE index_api_step_failures gauge"]
+
+    for (step, action), step_spans in sorted(steps.items()):
+        durations = sorted(span.duration for span in step_spans)
+        counts = [sum(1 for duration in durations if duration <= bound) for bound in trace_buckets]
+        failures = sum(1 for span in step_spans if not span.ok)
+
+        report["steps"].append({
+            "step": step,
+            "action": action,
+            "count": len(durations),
+            "failures": failures,
+            "sum": round(sum(durations), 6),
+            "min": round(durations[0], 6),
+            "p50": round(percentile(durations, 0.5), 6),
+            "p95": round(percentile(durations, 0.95), 6),
+            "max": round(durations[-1], 6),
+            "histogram": dict(zip([str(bound) for bound in trace_buckets], counts)),
+        })
+
+        # Prometheus histograms are cumulative, and end with a +Inf bucket.
+        labels = 'step="' + step + '",action="' + action + '"'
+        for bound, count in zip(trace_buckets, counts):
+            prom_lines.append("index_api_step_duration_seconds_bucket{" + labels + ',le="' + str(bound) + '"} ' + str(count))
+        prom_lines.append("index_api_step_duration_seconds_bucket{" + labels + ',le="+Inf"} ' + str(len(durations)))
+        prom_lines.append("index_api_step_duration_seconds_sum{" + labels + "} " + str(round(sum(durations), 6)))
+        prom_lines.append("index_api_step_duration_seconds_count{" + labels + "} " + str(len(durations)))
+        failure_lines.append("index_api_step_failures{" + labels + "} " + str(failures))
+
+    # Write both files atomically, so the textfile collector never reads a partial file.
+    os.makedirs(directory, exist_ok=True)
+    outputs = [("index_api-trace-" + trace_run_id + ".json", json.dumps(report, indent=2)),
+               ("index_api.prom", "\n".join(prom_lines + failure_lines) + "\n")]
+    for name, content in outputs:
+        temp_file = os.path.join(directory, "." + name + ".tmp")
+        with open(temp_file, "w") as output_file:
+            output_file.write(content)
+        os.replace(temp_file, os.path.join(directory, name))
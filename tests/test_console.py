@@ -0,0 +1,82 @@
+###########################################################################################
+# Module:      tests.test_console
+# Description: Tests for rendering the event stream to console, and for writing it to the
+#              event log.
+###########################################################################################
+
+
+import json
+
+from index_restart import console
+from index_restart.console import ConsoleRenderer
+from index_restart.events import EventStream
+
+
+# Class to stand in for the colorama colors, so the output is plain text.
+class PlainFore:
+    BLUE = "<blue>"
+    RED = "<red>"
+    BLACK = ""
+
+
+# The events of a node are held back until it is done and printed as one block, so nodes worked on in parallel do not interleave. Other events are printed right away.
+def test_node_blocks(capsys, monkeypatch):
+
+    monkeypatch.setattr(console, "Fore", PlainFore())
+    renderer = ConsoleRenderer()
+
+    for event in [
+        {"event": "node_started", "host": "host1", "node": "node1", "message": "Performing the restart command on node1"},
+        {"event": "node_started", "host": "host2", "node": "node1", "message": "Performing the restart command on node1"},
+        {"event": "restart", "host": "host2", "node": "node1", "status": "failed", "message": "The restart command FAILED."},
+        {"event": "probe", "host": "host3", "port": 8443},
+        {"event": "skip", "host": "host3", "node": "node1", "status": "failed", "message": "Skipping host3: node1."},
+        {"event": "restart", "host": "host1", "node": "node1", "status": "ok", "message": "The restart command was successful."},
+        {"event": "node_done", "host": "host2", "node": "node1", "status": "failed"},
+        {"event": "node_done", "host": "host1", "node": "node1", "status": "ok"},
+    ]:
+        renderer.render(event)
+
+    assert capsys.readouterr().out.splitlines() == [
+        "<red>Skipping host3: node1.",
+        "<blue>",
+        "*********** host2 ***********",
+        "Performing the restart command on node1",
+        "<red>The restart command FAILED.",
+        "<blue>",
+        "*********** host1 ***********",
+        "Performing the restart command on node1",
+        "The restart command was successful.",
+    ]
+    assert renderer.blocks == {}
+
+
+# Headings are printed in blue, failed events in red, and events without a message not at all.
+def test_colors(capsys, monkeypatch):
+
+    monkeypatch.setattr(console, "Fore", PlainFore())
+    renderer = ConsoleRenderer()
+
+    renderer.render({"event": "plan", "message": "Restart plan"})
+    renderer.render({"event": "plan_blocked", "status": "failed", "message": "Blocked"})
+    renderer.render({"event": "plan_wave", "message": "1. at 0:00:00"})
+    renderer.render({"event": "probe"})
+
+    assert capsys.readouterr().out.splitlines() == ["<blue>Restart plan", "<red>Blocked", "1. at 0:00:00"]
+
+
+# The event log gets one JSON object per event, in order, without the fields that are None.
+def test_event_log(tmp_path):
+
+    path = str(tmp_path / "events.jsonl")
+    stream = EventStream(path, console = False)
+    stream.emit("node_started", host = "host1", node = "node1", side = None)
+    stream.emit("node_done", host = "host1", node = "node1", status = "ok")
+    stream.close()
+
+    with open(path) as log_file:
+        events = [json.loads(line) for line in log_file]
+
+    assert [(event["seq"], event["event"]) for event in events] == [(1, "node_started"), (2, "node_done")]
+    assert "side" not in events[0]
+    assert events[1]["status"] == "ok"
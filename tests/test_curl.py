@@ -0,0 +1,18 @@
+###########################################################################################
+# Module:      tests.test_curl
+# Description: Tests for the warm-up of a restarted node.
+###########################################################################################
+
+
+from index_restart.curl import WarmupResult, warm_up_node
+
+
+# Without any queries the node can not be warmed up, and nothing is curled.
+def test_warm_up_without_queries():
+
+    result = warm_up_node("127.0.0.1", 1, queries = [])
+
+    assert result.success is False
+    assert result.rounds == []
+    assert "no warm-up queries" in result.reason
+    assert isinstance(result, WarmupResult)
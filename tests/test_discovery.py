@@ -0,0 +1,94 @@
+###########################################################################################
+# Module:      tests.test_discovery
+# Description: Tests for parsing the output of the node discovery command, and for the
+#              service port of a discovered node.
+###########################################################################################
+
+
+import json
+import time
+
+from index_restart import discovery
+from index_restart.discovery import discovery_marker, node_port, parse_discovery
+from index_restart.inventory import Inventory
+
+
+ss_header = "State  Recv-Q Send-Q Local Address:Port  Peer Address:Port Process\n"
+
+
+# Each running unit gets the public ports of its main pid. The loopback shutdown port and the ports of other pids are left out, a stopped unit has no ports.
+# systemctl show prints MainPID before Id, one block per unit.
+def test_discovery():
+
+    stdout = ("MainPID=1201\nId=tomcat@node1.service\n\n"
+              "MainPID=1202\nId=tomcat@node2.service\n\n"
+              "MainPID=0\nId=tomcat@node3.service\n"
+              + discovery_marker + "\n" + ss_header +
+              "LISTEN 0      100    *:8443             *:*    users:((\"java\",pid=1201,fd=51))\n"
+              "LISTEN 0      1      127.0.0.1:8005     0.0.0.0:*    users:((\"java\",pid=1201,fd=60))\n"
+              "LISTEN 0      100    0.0.0.0:8543       0.0.0.0:*    users:((\"java\",pid=1201,fd=52))\n"
+              "LISTEN 0      100    [::]:8444          [::]:*    users:((\"java\",pid=1202,fd=51))\n"
+              "LISTEN 0      1      [::ffff:127.0.0.1]:8006 *:*    users:((\"java\",pid=1202,fd=60))\n"
+              "LISTEN 0      128    0.0.0.0:22         0.0.0.0:*    users:((\"sshd\",pid=900,fd=3))\n")
+
+    assert parse_discovery(stdout) == {
+        "tomcat@node1.service": [8443, 8543],
+        "tomcat@node2.service": [8444],
+        "tomcat@node3.service": [],
+    }
+
+
+# The blocks are told apart by their properties too, whatever their order and even without the blank lines.
+def test_discovery_property_order():
+
+    listeners = discovery_marker + "\n" + ss_header + "LISTEN 0 100 *:8443 *:* users:((\"java\",pid=1201,fd=51))\nLISTEN 0 100 *:8444 *:* users:((\"java\",pid=1202,fd=51))\n"
+    expected = {"tomcat@node1.service": [8443], "tomcat@node2.service": [8444]}
+
+    assert parse_discovery("Id=tomcat@node1.service\nMainPID=1201\n\nId=tomcat@node2.service\nMainPID=1202\n" + listeners) == expected
+    assert parse_discovery("MainPID=1201\nId=tomcat@node1.service\nMainPID=1202\nId=tomcat@node2.service\n" + listeners) == expected
+
+
+# Without output there are no units, and without the listeners the units have no ports.
+def test_discovery_no_output():
+
+    assert parse_discovery("") == {}
+    assert parse_discovery("ssh: connect to host host1 port 22: Connection refused\n") == {}
+    assert parse_discovery("MainPID=1201\nId=tomcat@node1.service\n") == {"tomcat@node1.service": []}
+    assert parse_discovery("MainPID=1201\nId=tomcat@node1.service\n" + discovery_marker + "\n") == {"tomcat@node1.service": []}
+
+
+# Units that are not tomcat nodes, and lines that are not listeners, are ignored.
+def test_discovery_bad_lines():
+
+    stdout = ("MainPID=700\nId=elasticsearch.service\n\n"
+              "MainPID=1201\nId=tomcat@node1.service\n"
+              + discovery_marker + "\n" + ss_header +
+              "sudo: a terminal is required\n"
+              "LISTEN 0 100 *:http *:* users:((\"java\",pid=1201,fd=51))\n"
+              "LISTEN 0 100 *:9200 *:* users:((\"java\",pid=700,fd=51))\n"
+              "LISTEN 0 100 *:8443 *:* users:((\"java\",pid=1201,fd=52))\n")
+
+    assert parse_discovery(stdout) == {"tomcat@node1.service": [8443]}
+
+
+# The inventory port of a node always wins. A node the inventory does not list only gets a port if it listens on exactly one.
+def test_node_port(tmp_path, monkeypatch):
+
+    path = str(tmp_path / "inventories.json")
+    with open(path, "w") as inventory_file:
+        json.dump({"environments": {"prod_a": {"hosts": ["host1"], "services": {"index": {"tomcat@node1.service": 8443}}}}, "functions": {}}, inventory_file)
+
+    monkeypatch.setattr(discovery, "discovery", "Yes")
+    monkeypatch.setattr(discovery, "discovery_cache_loaded", True)
+    monkeypatch.setitem(discovery.discovery_cache, "host1", {"time": time.time(), "units": {
+        "tomcat@node1.service": [8080, 8443],
+        "tomcat@node2.service": [8444],
+        "tomcat@node3.service": [8081, 8445],
+        "tomcat@node4.service": [],
+    }})
+    inventory = Inventory(path, str(tmp_path))
+
+    assert node_port("host1", "prod_a", "tomcat@node1.service", inventory) == 8443
+    assert node_port("host1", "prod_a", "tomcat@node2.service", inventory) == 8444
+    assert node_port("host1", "prod_a", "tomcat@node3.service", inventory) is None
+    assert node_port("host1", "prod_a", "tomcat@node4.service", inventory) is None
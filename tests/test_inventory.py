@@ -0,0 +1,102 @@
+###########################################################################################
+# Module:      tests.test_inventory
+# Description: Tests for loading the inventory through its cached snapshot, and for the
+#              lookup index and host profiles built from it.
+###########################################################################################
+
+
+import json
+import os
+
+from index_restart.inventory import Inventory, load_inventory, server_profile
+
+
+contents = {
+    "environments": {"prod_a": {"hosts": ["host1", "host2"], "split": "True", "monitor_file": "monitor.json", "services": {"index": {"tomcat@node1.service": 8443}}}},
+    "functions": {"data_access_layer": {"hosts": ["host1"]}, "middle_tier_and_ui": {"hosts": ["host2"]}},
+    "server_type": {"children": {"vm": {"hosts": ["host1"]}, "bm": {"hosts": ["host2"]}}},
+}
+
+
+# Function to write an inventory file. The output is its path.
+def write_inventory(tmp_path, data):
+
+    path = str(tmp_path / "inventories.json")
+    with open(path, "w") as inventory_file:
+        json.dump(data, inventory_file)
+    return path
+
+
+# Function to count the parses of the inventory file while the test runs.
+def count_parses(monkeypatch):
+
+    parses = []
+    json_loads = json.loads
+
+    def counted(raw):
+        parses.append(raw)
+        return json_loads(raw)
+
+    monkeypatch.setattr(json, "loads", counted)
+    return parses
+
+
+# The first load parses the file and writes the snapshot, the next one reads the snapshot as-is.
+def test_snapshot_reuse(tmp_path, monkeypatch):
+
+    path = write_inventory(tmp_path, contents)
+    cache_dir = str(tmp_path / "cache")
+    parses = count_parses(monkeypatch)
+
+    data, index = load_inventory(path, cache_dir)
+    assert len(parses) == 1
+    assert len(os.listdir(cache_dir)) == 1
+    assert index.host_env == {"host1": "prod_a", "host2": "prod_a"}
+    assert index.env_function_hosts == {("prod_a", "data_access_layer"): ["host1"], ("prod_a", "middle_tier_and_ui"): ["host2"]}
+
+    assert load_inventory(path, cache_dir) == (data, index)
+    assert len(parses) == 1
+
+
+# A file that was touched but not changed keeps its snapshot. A changed file is parsed again.
+def test_snapshot_changed_file(tmp_path, monkeypatch):
+
+    path = write_inventory(tmp_path, contents)
+    cache_dir = str(tmp_path / "cache")
+    parses = count_parses(monkeypatch)
+    load_inventory(path, cache_dir)
+
+    stat = os.stat(path)
+    os.utime(path, ns = (stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    load_inventory(path, cache_dir)
+    assert len(parses) == 1
+
+    changed = dict(contents, environments = {"prod_a": dict(contents["environments"]["prod_a"], hosts = ["host1", "host2", "host3"])})
+    write_inventory(tmp_path, changed)
+    data, index = load_inventory(path, cache_dir)
+    assert len(parses) == 2
+    assert index.host_env["host3"] == "prod_a"
+
+
+# A broken snapshot only costs a parse.
+def test_snapshot_broken(tmp_path):
+
+    path = write_inventory(tmp_path, contents)
+    cache_dir = str(tmp_path / "cache")
+    load_inventory(path, cache_dir)
+
+    for name in os.listdir(cache_dir):
+        with open(os.path.join(cache_dir, name), "wb") as snapshot_file:
+            snapshot_file.write(b"not a pickle")
+
+    assert load_inventory(path, cache_dir)[1].host_server_type == {"host1": "vm", "host2": "bm"}
+
+
+# A host profile is read from the given Inventory, and a host it does not have is an error message.
+def test_server_profile(tmp_path):
+
+    inventory = Inventory(write_inventory(tmp_path, contents), str(tmp_path / "cache"))
+
+    profile = server_profile("host1", inventory)
+    assert (profile.env, profile.split_env, profile.monitor_file, profile.function) == ("prod_a", "True", "monitor.json", ["data_access_layer"])
+    assert server_profile("host9", inventory) == "The hosts function could not be found."
@@ -0,0 +1,74 @@
+###########################################################################################
+# Module:      tests.test_journal
+# Description: Tests for reading the progress journal back on resume.
+###########################################################################################
+
+
+import json
+import time
+
+from index_restart.journal import JournalEntry, journal_load, journal_record
+
+
+# Function to write journal lines. entries is a list of (run, host, node, state, f5), written with the current time unless a time is given.
+def write_journal(path, entries, tail = ""):
+
+    with open(path, "w") as journal:
+        for entry in entries:
+            run, host, node, state, f5 = entry[:5]
+            stamp = entry[5] if len(entry) > 5 else time.time()
+            journal.write(json.dumps({"run": run, "time": stamp, "host": host, "node": node, "state": state, "f5": f5}) + "\n")
+        journal.write(tail)
+
+
+# The last state of each node is kept, and the F5 removal sticks once recorded.
+def test_journal_load(tmp_path):
+
+    path = str(tmp_path / "journal.jsonl")
+    write_journal(path, [
+        ("run1", "host1", "node1", "started", False),
+        ("run1", "host1", "node1", "drained", True),
+        ("run1", "host1", "node1", "restarted", False),
+        ("run1", "host1", "node2", "started", False),
+        ("run1", "host1", "node2", "failed", False),
+        ("run2", "host1", "node1", "done", False),
+    ])
+
+    assert journal_load("run1", path) == {
+        ("host1", "node1"): JournalEntry("restarted", True),
+        ("host1", "node2"): JournalEntry("failed", False),
+    }
+
+
+# A partly written last line (ex. the job was killed mid write) is skipped, the lines before it still count.
+def test_journal_load_partial_last_line(tmp_path):
+
+    path = str(tmp_path / "journal.jsonl")
+    write_journal(path, [("run1", "host1", "node1", "drained", True)], tail = '{"run": "run1", "time": ' + str(time.time()) + ', "host": "host1", "node": "no')
+
+    assert journal_load("run1", path) == {("host1", "node1"): JournalEntry("drained", True)}
+
+
+# A run that completed starts over, and entries older than resume_window are ignored.
+def test_journal_load_complete_and_old(tmp_path):
+
+    path = str(tmp_path / "journal.jsonl")
+    write_journal(path, [
+        ("run1", "host1", "node9", "drained", True, 1),
+        ("run1", "host1", "node1", "done", True),
+        ("run1", None, None, "complete", False),
+        ("run1", "host1", "node2", "drained", True),
+    ])
+
+    assert journal_load("run1", path) == {("host1", "node2"): JournalEntry("drained", True)}
+
+
+# A missing journal, or one without the run, resumes nothing.
+def test_journal_load_missing(tmp_path):
+
+    path = str(tmp_path / "journal.jsonl")
+    assert journal_load("run1", path) == {}
+
+    journal_record("run2", "host1", "node1", "done", path = path)
+    assert journal_load("run1", path) == {}
+    assert journal_load("run2", path) == {("host1", "node1"): JournalEntry("done", False)}
@@ -0,0 +1,102 @@
+###########################################################################################
+# Module:      tests.test_plan
+# Description: Tests for the restart planner: the simulated schedule and the predicted
+#              duration from the journal.
+###########################################################################################
+
+
+import json
+
+import pytest
+
+from index_restart import discovery, plan
+from index_restart.inventory import Inventory
+from index_restart.plan import plan_restart, simulate_schedule
+from index_restart.restart import restart_jobs
+
+
+nodes = ["tomcat@node1.service", "tomcat@node2.service", "tomcat@node3.service"]
+
+
+# Fixture for a split env with two data api hosts of three nodes each, and a host with a single node. The output is the Inventory.
+@pytest.fixture
+def inventory(tmp_path, monkeypatch):
+
+    path = str(tmp_path / "inventories.json")
+    with open(path, "w") as inventory_file:
+        json.dump({"environments": {"prod_a": {"hosts": ["host1", "host2"], "split": "True", "monitor_file": "monitor.json", "services": {"index": {node: 8443 + index for index, node in enumerate(nodes)}}},
+                                    "at": {"hosts": ["host3"], "split": "True", "monitor_file": "monitor.json", "services": {"index": {nodes[0]: 8443}}}},
+                   "functions": {"data_access_layer": {"hosts": ["host1", "host2", "host3"]}}}, inventory_file)
+
+    monkeypatch.setattr(discovery, "discovery", "No")
+    return Inventory(path, str(tmp_path))
+
+
+# Function to write a journal where every node of the data api took the given number of seconds. The output is its path.
+def write_journal(tmp_path, seconds):
+
+    path = str(tmp_path / "journal.jsonl")
+    with open(path, "w") as journal:
+        for run, node in enumerate(nodes):
+            journal.write(json.dumps({"run": str(run), "time": 1000, "host": "host1", "node": node, "state": "started"}) + "\n")
+            journal.write(json.dumps({"run": str(run), "time": 1000 + seconds, "host": "host1", "node": node, "state": "reinserted"}) + "\n")
+    return path
+
+
+# Jobs of one group go one at a time under the default limit, and side by side once the limit allows it. A host never loses its last live node.
+def test_simulate_schedule(inventory):
+
+    action_results, jobs, profiles = restart_jobs({"host1": nodes[:2], "host2": nodes[:1]}, "restart", inventory = inventory)
+    durations = {(job.host, job.node): 100 for job in jobs}
+
+    planned, blocked = simulate_schedule(jobs, durations, 4, {}, 1, inventory = inventory)
+    assert [(item.job.host, item.job.node, item.start, item.end) for item in planned] == [
+        ("host1", nodes[0], 0, 100), ("host1", nodes[1], 100, 200), ("host2", nodes[0], 200, 300)]
+    assert blocked == []
+
+    planned, blocked = simulate_schedule(jobs, durations, 4, {}, 2, start = 10, inventory = inventory)
+    assert [(item.job.host, item.job.node, item.start) for item in planned] == [("host1", nodes[0], 10), ("host1", nodes[1], 10), ("host2", nodes[0], 110)]
+
+    planned, blocked = simulate_schedule(jobs, durations, 1, {"data_access_layer": 3}, inventory = inventory)
+    assert [item.start for item in planned] == [0, 100, 200]
+
+
+# The single node of a host is its last live node, so it is blocked.
+def test_simulate_schedule_last_live_node(inventory):
+
+    action_results, jobs, profiles = restart_jobs({"host3": nodes[:1]}, "restart", inventory = inventory)
+    planned, blocked = simulate_schedule(jobs, {("host3", nodes[0]): 100}, 4, {}, inventory = inventory)
+
+    assert planned == []
+    assert [(job.host, reason) for job, reason in blocked] == [("host3", "It is the last live node on host3.")]
+
+
+# The probes come first, then the canary on its own, then the rest. The durations come from the journal.
+def test_plan_restart(tmp_path, inventory, monkeypatch):
+
+    monkeypatch.setattr(plan, "restart_mode", "rolling")
+    monkeypatch.setattr(plan, "restart_order", "latency")
+    monkeypatch.setattr(plan, "canary", "Yes")
+    monkeypatch.setattr(plan, "plan_probe_seconds", 10)
+
+    restart_plan = plan_restart({"host1": nodes[:2], "host2": nodes[:1]}, parallel = 4, group_limits = {}, journal_path = write_journal(tmp_path, 100), inventory = inventory)
+
+    assert [[(item.job.host, item.job.node, item.start) for item in wave] for wave in restart_plan.waves] == [
+        [("host1", nodes[1], 10)], [("host1", nodes[0], 110)], [("host2", nodes[0], 210)]]
+    assert (restart_plan.predicted, restart_plan.predicted_p95) == (310, 310)
+    assert [(job.host, job.node) for job in restart_plan.drain_set[("prod_a", "data_access_layer")]] == [("host1", nodes[1]), ("host1", nodes[0]), ("host2", nodes[0])]
+    assert restart_plan.recommendation == (1, 1)
+
+
+# Without probes, a canary or history, the jobs start right away and take plan_default_node_seconds.
+def test_plan_restart_defaults(tmp_path, inventory, monkeypatch):
+
+    monkeypatch.setattr(plan, "restart_mode", "rolling")
+    monkeypatch.setattr(plan, "restart_order", "selection")
+    monkeypatch.setattr(plan, "canary", "No")
+    monkeypatch.setattr(plan, "plan_default_node_seconds", 180)
+
+    restart_plan = plan_restart({"host1": nodes[:2]}, parallel = 4, group_limits = {"data_access_layer": 2}, journal_path = str(tmp_path / "missing.jsonl"), inventory = inventory)
+
+    assert [[item.start for item in wave] for wave in restart_plan.waves] == [[0, 0]]
+    assert restart_plan.predicted == 180
@@ -0,0 +1,85 @@
+###########################################################################################
+# Module:      tests.test_remote
+# Description: Tests for parsing the output of the batched remote commands.
+###########################################################################################
+
+
+from index_restart.remote import F5Transition, parse_f5_transitions, parse_host_status, status_marker
+
+
+nodes = ["tomcat@node1.service", "tomcat@node2.service", "tomcat@node3.service"]
+
+
+# A drain where every monitor file ends up in the wanted state.
+def test_f5_transitions_all_drained():
+
+    stdout = "F5 0 true false\nF5 1 true false\nF5 2 false false\n"
+    transitions = parse_f5_transitions(nodes, stdout, "false")
+
+    assert transitions == {
+        "tomcat@node1.service": F5Transition("tomcat@node1.service", "true", "false", True),
+        "tomcat@node2.service": F5Transition("tomcat@node2.service", "true", "false", True),
+        "tomcat@node3.service": F5Transition("tomcat@node3.service", "false", "false", True),
+    }
+
+
+# A locked or missing monitor file is reported as such, and does not count as done.
+def test_f5_transitions_locked_and_missing():
+
+    stdout = "F5 0 true false\nF5 1 locked locked\nF5 2 missing missing\n"
+    transitions = parse_f5_transitions(nodes, stdout, "false")
+
+    assert transitions["tomcat@node1.service"].ok
+    assert transitions["tomcat@node2.service"] == F5Transition("tomcat@node2.service", "locked", "locked", False)
+    assert transitions["tomcat@node3.service"] == F5Transition("tomcat@node3.service", "missing", "missing", False)
+
+
+# Without output (ex. the ssh command failed) every node is unknown.
+def test_f5_transitions_no_output():
+
+    for stdout in ["", "ssh: connect to host host1 port 22: Connection refused\n"]:
+        transitions = parse_f5_transitions(nodes, stdout, "true")
+        assert all(transition == F5Transition(node, "unknown", "unknown", False) for node, transition in transitions.items())
+        assert list(transitions) == nodes
+
+
+# Lines that are not F5 lines, or point past the nodes, are ignored. A node missing from the output stays unknown.
+def test_f5_transitions_bad_lines():
+
+    stdout = "Warning: Permanently added 'host1'\nF5 x true false\nF5 7 true false\nF5 1 true\nF5 1 false true extra\nF5 0 false true\n"
+    transitions = parse_f5_transitions(nodes, stdout, "true")
+
+    assert transitions["tomcat@node1.service"] == F5Transition("tomcat@node1.service", "false", "true", True)
+    assert transitions["tomcat@node2.service"].prior == "unknown"
+    assert transitions["tomcat@node3.service"].prior == "unknown"
+
+
+# The unit states come before the marker, the monitor file states after it, one line per node.
+def test_host_status():
+
+    stdout = "active\ninactive\nfailed\n" + status_marker + "\nlive\ndrained\nmissing\n"
+
+    assert parse_host_status(nodes, stdout) == {
+        "tomcat@node1.service": ["active", "live"],
+        "tomcat@node2.service": ["inactive", "drained"],
+        "tomcat@node3.service": ["failed", "missing"],
+    }
+
+
+# Without the marker (ex. the ssh command failed) nothing can be told apart, so every state is unknown.
+def test_host_status_no_output():
+
+    for stdout in ["", "ssh: Could not resolve hostname host1\n", "active\nactive\nactive\n"]:
+        assert parse_host_status(nodes, stdout) == {node: ["unknown", "unknown"] for node in nodes}
+
+
+# Output that stops early leaves the rest of the nodes unknown. Blank lines are skipped.
+def test_host_status_truncated():
+
+    stdout = "active\n\nactive\nactive\n" + status_marker + "\nlive\n"
+
+    assert parse_host_status(nodes, stdout) == {
+        "tomcat@node1.service": ["active", "live"],
+        "tomcat@node2.service": ["active", "unknown"],
+        "tomcat@node3.service": ["active", "unknown"],
+    }
@@ -0,0 +1,133 @@
+###########################################################################################
+# Module:      tests.test_restart
+# Description: Tests for the F5 pool capacity guard of the rolling restart, the restart
+#              order and canary pick from the latency probes, and the blue/green sides.
+###########################################################################################
+
+
+from collections import namedtuple
+
+from index_restart import restart
+from index_restart.restart import CapacityGuard, NodeProbe, RestartJob, bluegreen_sides, order_jobs, parse_env_pairs, pick_canary
+
+
+# Function to build a restart job. Only the host, node and group matter to the guard.
+def job(host, node, env = "prod_a", function = "data_access_layer"):
+
+    return RestartJob(host, node, (env, function), None, None)
+
+
+# A hosts last live node is never taken out, while a node that is not live can always go.
+def test_last_live_node():
+
+    guard = CapacityGuard({"host1": ["node1"]}, default_limit = 5)
+
+    assert guard.blocked_reason(job("host1", "node1")) == "It is the last live node on host1."
+    assert guard.blocked_reason(job("host1", "node2")) == ""
+    assert guard.can_start(job("host1", "node2"))
+
+
+# The host keeps at least one live node while the others are out.
+def test_last_live_node_while_others_are_out():
+
+    guard = CapacityGuard({"host1": ["node1", "node2", "node3"]}, default_limit = 5)
+
+    guard.start(job("host1", "node1"))
+    assert guard.can_start(job("host1", "node2"))
+    guard.start(job("host1", "node2"))
+    assert not guard.can_start(job("host1", "node3"))
+
+    guard.finish(job("host1", "node1"), True)
+    assert guard.can_start(job("host1", "node3"))
+
+
+# A node that did not come back no longer counts as live, so the hosts other nodes can become its last live one.
+def test_node_not_back_live():
+
+    guard = CapacityGuard({"host1": ["node1", "node2"]}, default_limit = 5)
+
+    guard.start(job("host1", "node1"))
+    guard.finish(job("host1", "node1"), False)
+
+    assert guard.blocked_reason(job("host1", "node2")) == "It is the last live node on host1."
+
+
+# The group limit caps the live nodes out at once across hosts, and elasticsearch nodes always count against it.
+def test_group_limit():
+
+    guard = CapacityGuard({"host1": ["node1", "node2"], "host2": ["node1", "node2"], "host3": []}, default_limit = 1)
+
+    guard.start(job("host1", "node1"))
+    assert not guard.can_start(job("host2", "node1"))
+    assert guard.can_start(job("host2", "node1", env = "prod_b"))
+    guard.finish(job("host1", "node1"), True)
+    assert guard.can_start(job("host2", "node1"))
+
+    elastic_job = job("host3", "elasticsearch.service", function = "elastic_index_layer")
+    guard.start(elastic_job)
+    assert not guard.can_start(job("host3", "elasticsearch@data1.service", function = "elastic_index_layer"))
+
+
+# "env:function" overrides "function", which overrides the default.
+def test_group_limit_overrides():
+
+    guard = CapacityGuard({}, {"data_access_layer": 2, "prod_a:data_access_layer": 3}, default_limit = 1)
+
+    assert guard.limit(("prod_a", "data_access_layer")) == 3
+    assert guard.limit(("prod_b", "data_access_layer")) == 2
+    assert guard.limit(("prod_a", "middle_tier_and_ui")) == 1
+
+
+# Unhealthy nodes go first, then the slowest. Nodes without a probe keep their order at the end.
+def test_order_jobs():
+
+    jobs = [job("host1", "node1"), job("host1", "node2"), job("host2", "node1"), job("host2", "node2"), job("host3", "node1")]
+    probes = {
+        ("host1", "node1"): NodeProbe(True, 0.1, 0),
+        ("host1", "node2"): NodeProbe(True, 0.3, 0),
+        ("host2", "node1"): NodeProbe(False, 0.2, 1),
+        ("host2", "node2"): NodeProbe(False, None, 3),
+    }
+
+    assert [(item.host, item.node) for item in order_jobs(jobs, probes)] == [("host2", "node1"), ("host2", "node2"), ("host1", "node2"), ("host1", "node1"), ("host3", "node1")]
+
+
+# The canary is the healthy node with the median latency. Unhealthy and unprobed nodes are never picked.
+def test_pick_canary():
+
+    jobs = [job("host1", "node1"), job("host1", "node2"), job("host2", "node1"), job("host2", "node2")]
+    probes = {
+        ("host1", "node1"): NodeProbe(True, 0.3, 0),
+        ("host1", "node2"): NodeProbe(True, 0.1, 0),
+        ("host2", "node1"): NodeProbe(True, 0.2, 0),
+        ("host2", "node2"): NodeProbe(False, 0.15, 1),
+    }
+
+    assert pick_canary(jobs, probes) == job("host2", "node1")
+    assert pick_canary(jobs, {("host2", "node2"): probes[("host2", "node2")]}) is None
+    assert pick_canary([], {}) is None
+
+
+# The pairs are read in order, and items without a pair are skipped.
+def test_parse_env_pairs():
+
+    assert parse_env_pairs("prod_a:prod_b, fr_a : fr_b") == [("prod_a", "prod_b"), ("fr_a", "fr_b")]
+    assert parse_env_pairs("prod_a,,fr_a:fr_b") == [("fr_a", "fr_b")]
+    assert parse_env_pairs("") == []
+
+
+# The web nodes of split paired envs are grouped by side, in env_pairs order. Everything else is left for the rolling restart.
+def test_bluegreen_sides(monkeypatch):
+
+    monkeypatch.setattr(restart, "env_pairs", "prod_a:prod_b")
+    Profile = namedtuple("Profile", ["env", "split_env"])
+
+    def side_job(host, env, function = "data_access_layer", split_env = "True"):
+        return RestartJob(host, "node1", (env, function), Profile(env, split_env), None)
+
+    jobs = [side_job("host1", "prod_b"), side_job("host2", "prod_a"), side_job("host3", "prod_a", "middle_tier_and_ui"),
+            side_job("host4", "at"), side_job("host5", "prod_a", split_env = "False"), side_job("host6", "prod_b", "elastic_index_layer")]
+    sides, rolling_jobs = bluegreen_sides(jobs)
+
+    assert [(side, live_side, [item.host for item in side_jobs]) for side, live_side, side_jobs in sides] == [("prod_a", "prod_b", ["host2", "host3"]), ("prod_b", "prod_a", ["host1"])]
+    assert [item.host for item in rolling_jobs] == ["host4", "host5", "host6"]
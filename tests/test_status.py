@@ -0,0 +1,107 @@
+###########################################################################################
+# Module:      tests.test_status
+# Description: Tests for the incremental health sweep: change detection and the due times
+#              of the sweep cache.
+###########################################################################################
+
+
+import datetime
+import json
+import os
+import time
+
+import pytest
+
+from index_restart import discovery, status
+from index_restart.curl import CurlResult
+from index_restart.inventory import Inventory
+from index_restart.status import sweep_service_ports
+
+
+url1 = "https://host1:8443/health"
+url2 = "https://host2:8443/health"
+
+
+# Fixture to sweep a two host env. The curls are answered from the returned dictionary of {"url": status code}, and the curled urls are collected in its "curled" list.
+@pytest.fixture
+def sweep(tmp_path, monkeypatch):
+
+    path = str(tmp_path / "inventories.json")
+    with open(path, "w") as inventory_file:
+        json.dump({"environments": {"prod_a": {"hosts": ["host1", "host2"], "services": {"index": {"tomcat@node1.service": 8443}}}},
+                   "functions": {"data_access_layer": {"hosts": ["host1", "host2"]}}}, inventory_file)
+
+    answers = {url1: 200, url2: 200, "curled": []}
+
+    def curl_probes(probes, workers = None, per_host = None, timeout = None):
+        answers["curled"] += [probe[3] for probe in probes]
+        return [CurlResult(answers[probe[3]], "", datetime.timedelta(seconds = 0.01), "") for probe in probes]
+
+    monkeypatch.setattr(discovery, "discovery", "No")
+    monkeypatch.setattr(status, "curl_probes", curl_probes)
+    monkeypatch.setattr(status, "sweep_cache_dir", str(tmp_path / "cache"))
+    monkeypatch.setattr(status, "sweep_cache", {})
+    inventory = Inventory(path, str(tmp_path))
+
+    def run():
+        answers["curled"] = []
+        return sweep_service_ports("prod_a", "data_access_layer", "index", uri = "/health", inventory = inventory)
+
+    return answers, run
+
+
+# Only the changes since the previous sweep are reported, and healthy endpoints are taken from the cache.
+def test_sweep_changes(sweep):
+
+    answers, run = sweep
+
+    answers[url2] = 500
+    result = run()
+    assert result.failed_curls == {"host2": ["8443"]}
+    assert result.newly_failed == {"host2": ["8443"]}
+    assert (result.probed, result.cached) == (2, 0)
+
+    # Still failing: curled again, but not newly failed. The healthy endpoint comes from the cache.
+    result = run()
+    assert answers["curled"] == [url2]
+    assert result.failed_curls == {"host2": ["8443"]}
+    assert result.newly_failed == {}
+    assert (result.probed, result.cached) == (1, 1)
+
+    answers[url2] = 200
+    result = run()
+    assert result.failed_curls == {}
+    assert result.recovered == {"host2": ["8443"]}
+
+
+# A healthy endpoint comes due again within the last quarter of sweep_healthy_ttl, a failing one right away. Once due, it is curled again.
+def test_sweep_due_times(sweep):
+
+    answers, run = sweep
+
+    answers[url2] = 500
+    before = time.time()
+    run()
+
+    healthy, failing = status.sweep_cache[url1], status.sweep_cache[url2]
+    assert before + status.sweep_healthy_ttl * 0.75 <= healthy["due"] <= time.time() + status.sweep_healthy_ttl
+    assert failing["due"] <= time.time()
+
+    status.sweep_cache[url1]["due"] = 0
+    answers[url1] = 500
+    result = run()
+    assert sorted(answers["curled"]) == [url1, url2]
+    assert result.newly_failed == {"host1": ["8443"]}
+
+
+# The cache is written to disk, so the next job only curls what is due.
+def test_sweep_cache_file(sweep, monkeypatch):
+
+    answers, run = sweep
+    run()
+    assert os.path.exists(os.path.join(status.sweep_cache_dir, "sweep.json"))
+
+    monkeypatch.setattr(status, "sweep_cache", {})
+    result = run()
+    assert answers["curled"] == []
+    assert (result.probed, result.cached) == (0, 2)